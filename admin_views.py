@@ -3,71 +3,211 @@ import pandas as pd
 import json
 from datetime import datetime
 from database import db
+from navigation import show_active_section
+from response_browser import show_response_filters, load_response_stats, show_response_page
+from export_views import show_export_controls
+from response_editor import show_response_editor
+from fragments import async_fragment, rerun_fragment
+from loaders import load_all
+from jobs import job_manager, JOB_DONE, JOB_FAILED
+from outbox import submission_outbox
+from user_import import read_users_file, validate_users_frame, run_import_job, users_template_csv, IMPORT_COLUMNS
 
 async def show_admin_dashboard():
     st.title("لوحة تحكم النظام")
     
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
-        "إدارة المستخدمين",
-        "إدارة المحافظات", 
-        "إدارة الإدارات الصحية",     
-        "إدارة الاستبيانات", 
-        "عرض البيانات"
-    ])
-    
-    with tab1:
-        await manage_users()
-    with tab2:
-        await manage_governorates()
-    with tab3:
-        await manage_regions()
-    with tab4:
-        await manage_surveys()
-    with tab5:
-        await view_data()
+    await show_active_section({
+        "إدارة المستخدمين": manage_users,
+        "إدارة المحافظات": manage_governorates,
+        "إدارة الإدارات الصحية": manage_regions,
+        "إدارة الاستبيانات": manage_surveys,
+        "عرض البيانات": view_data,
+        "صندوق الإرسال": show_outbox_status,
+        "حمل قاعدة البيانات": show_database_load
+    }, key="admin_section")
+
+USER_ROLES = {"admin": "مسؤول نظام", "governorate_admin": "مسؤول محافظة", "employee": "موظف"}
+USERS_PAGE_SIZE = 50
 
 async def manage_users():
     st.header("إدارة المستخدمين")
     
-    users = await db.d1.fetch_all('''
-    SELECT u.user_id, u.username, u.role, 
-           COALESCE(g.governorate_name, ga.governorate_name) as governorate_name, 
-           h.admin_name
-    FROM Users u
-    LEFT JOIN HealthAdministrations h ON u.assigned_region = h.admin_id
-    LEFT JOIN Governorates g ON h.governorate_id = g.governorate_id
-    LEFT JOIN (
-        SELECT ga.user_id, g.governorate_name 
-        FROM GovernorateAdmins ga
-        JOIN Governorates g ON ga.governorate_id = g.governorate_id
-    ) ga ON u.user_id = ga.user_id
-    ORDER BY u.user_id
-    ''')
+    governorates = await db.get_governorates_list()
     
-    for user in users:
-        col1, col2, col3, col4, col5, col6 = st.columns([2, 2, 2, 2, 1, 1])
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        username_prefix = st.text_input("بحث باسم المستخدم", key="users_filter_username").strip()
+    with col2:
+        role = st.selectbox(
+            "الدور",
+            options=[None] + list(USER_ROLES.keys()),
+            format_func=lambda x: "الكل" if x is None else USER_ROLES[x],
+            key="users_filter_role"
+        )
+    with col3:
+        governorate_id = st.selectbox(
+            "المحافظة",
+            options=[None] + [g[0] for g in governorates],
+            format_func=lambda x: "الكل" if x is None else next(g[1] for g in governorates if g[0] == x),
+            key="users_filter_gov"
+        )
+    with col4:
+        health_admins = await db.get_health_admins_by_governorate(governorate_id) if governorate_id else []
+        admin_id = st.selectbox(
+            "الإدارة الصحية",
+            options=[None] + [a[0] for a in health_admins],
+            format_func=lambda x: "الكل" if x is None else next(a[1] for a in health_admins if a[0] == x),
+            key="users_filter_admin"
+        )
+    
+    filters = {
+        'username': username_prefix,
+        'role': role,
+        'governorate_id': governorate_id,
+        'admin_id': admin_id
+    }
+    
+    # إعادة الترقيم إلى الصفحة الأولى عند تغيير البحث
+    pager = st.session_state.get('users_pager')
+    if not pager or pager['filters'] != filters:
+        pager = {'filters': dict(filters), 'cursors': [None]}
+        st.session_state.users_pager = pager
+    
+    total = await db.count_users(filters)
+    users = await db.search_users(filters, USERS_PAGE_SIZE, pager['cursors'][-1])
+    
+    df = pd.DataFrame(
+        [(u[1], USER_ROLES.get(u[2], u[2]), u[3] if u[3] else "غير محدد", u[4] if u[4] else "غير محدد")
+         for u in users],
+        columns=["اسم المستخدم", "الدور", "المحافظة", "الإدارة الصحية"]
+    )
+    event = st.dataframe(
+        df,
+        use_container_width=True,
+        hide_index=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        key=f"users_table_{len(pager['cursors'])}"
+    )
+    
+    page_number = len(pager['cursors'])
+    page_count = max((total + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE, 1)
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ السابق", key="users_prev", disabled=page_number == 1):
+            pager['cursors'].pop()
+            st.rerun()
+    with col2:
+        st.caption(f"صفحة {page_number} من {page_count} — {total} مستخدم")
+    with col3:
+        if st.button("التالي ➡️", key="users_next",
+                     disabled=len(users) < USERS_PAGE_SIZE or page_number >= page_count):
+            pager['cursors'].append(users[-1][1])
+            st.rerun()
+    
+    selected_rows = event.selection.rows
+    if selected_rows and selected_rows[0] < len(users):
+        selected_user = users[selected_rows[0]]
+        col1, col2, col3 = st.columns([4, 1, 1])
         with col1:
-            st.write(user[1])
+            st.write(f"المستخدم المحدد: **{selected_user[1]}**")
         with col2:
-            role = "مسؤول نظام" if user[2] == "admin" else "مسؤول محافظة" if user[2] == "governorate_admin" else "موظف"
-            st.write(role)
+            if st.button("تعديل", key=f"edit_{selected_user[0]}"):
+                st.session_state.editing_user = selected_user[0]
         with col3:
-            st.write(user[3] if user[3] else "غير محدد")
-        with col4:
-            st.write(user[4] if user[4] else "غير محدد")
-        with col5:
-            if st.button("تعديل", key=f"edit_{user[0]}"):
-                st.session_state.editing_user = user[0]
-        with col6:
-            if st.button("حذف", key=f"delete_{user[0]}"):
-                await delete_user(user[0])
+            if st.button("حذف", key=f"delete_{selected_user[0]}"):
+                await delete_user(selected_user[0])
                 st.rerun()
     
     if 'editing_user' in st.session_state:
-        await edit_user_form(st.session_state.editing_user)
+        edit_user_form(st.session_state.editing_user)
     
     with st.expander("إضافة مستخدم جديد"):
         await add_user_form()
+    
+    with st.expander("📥 استيراد مستخدمين من ملف"):
+        await import_users_form()
+
+async def import_users_form():
+    st.caption("الأعمدة المطلوبة: " + "، ".join(IMPORT_COLUMNS)
+               + " — تفصل أسماء الاستبيانات بفاصلة منقوطة (;)")
+    st.download_button(
+        "تنزيل نموذج الملف",
+        data=users_template_csv(),
+        file_name="users_template.csv",
+        mime="text/csv",
+        key="users_import_template"
+    )
+    
+    uploaded_file = st.file_uploader("اختر ملف CSV أو Excel", type=["csv", "xlsx"], key="users_import_file")
+    
+    if 'users_import_job' in st.session_state:
+        job = job_manager.get(st.session_state.users_import_job)
+        if job is None:
+            del st.session_state.users_import_job
+        elif not job.finished:
+            st.progress(job.progress, text=job.message or "جاري الاستيراد...")
+            st.button("🔄 تحديث الحالة", key="refresh_users_import")
+            return
+        else:
+            job_manager.pop_result(job.job_id)
+            del st.session_state.users_import_job
+            st.session_state.pop('users_import_validation', None)
+            if job.status == JOB_DONE:
+                st.success(f"تم استيراد {job.result['imported']} مستخدم بنجاح")
+            elif job.status == JOB_FAILED:
+                st.error(f"حدث خطأ أثناء استيراد المستخدمين: {job.error}")
+            else:
+                st.info("تم إلغاء الاستيراد")
+            return
+    
+    if uploaded_file is None:
+        return
+    
+    # التحقق من الملف مرة واحدة لكل ملف مرفوع
+    validation = st.session_state.get('users_import_validation')
+    if not validation or validation['file_id'] != uploaded_file.file_id:
+        try:
+            df = read_users_file(uploaded_file)
+        except Exception as e:
+            st.error(f"تعذر قراءة الملف: {str(e)}")
+            return
+        try:
+            validated = await validate_users_frame(df)
+        except Exception as e:
+            st.error(f"تعذر التحقق من الملف: {str(e)}")
+            return
+        validation = {'file_id': uploaded_file.file_id, 'df': validated}
+        st.session_state.users_import_validation = validation
+    
+    df = validation['df']
+    invalid = df[df["errors"] != ""]
+    valid = df[df["errors"] == ""]
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("إجمالي الصفوف", len(df))
+    col2.metric("صفوف صالحة", len(valid))
+    col3.metric("صفوف بها أخطاء", len(invalid))
+    
+    if not invalid.empty:
+        report = invalid[["username", "role", "governorate", "health_administration", "surveys", "errors"]].copy()
+        report.insert(0, "رقم الصف", report.index + 2)
+        st.dataframe(report.rename(columns={"errors": "الأخطاء"}), use_container_width=True, hide_index=True)
+        st.download_button(
+            "تنزيل تقرير الأخطاء",
+            data=report.to_csv(index=False).encode("utf-8-sig"),
+            file_name="users_import_errors.csv",
+            mime="text/csv",
+            key="users_import_errors"
+        )
+    
+    if st.button(f"استيراد {len(valid)} مستخدم صالح", key="users_import_submit", disabled=valid.empty):
+        st.session_state.users_import_job = job_manager.submit(
+            "users_import", run_import_job, valid.drop(columns=["errors"]),
+            owner=st.session_state.user_id
+        )
+        st.rerun()
 
 async def add_user_form():
     governorates = await db.get_governorates_list()
@@ -181,15 +321,22 @@ async def add_user_form():
                 st.error("يرجى اختيار إدارة صحية للموظف")
                 return
 
-            if await db.add_user(username, password, role, st.session_state.add_user_form_data['admin_id']):
-                user_id = (await db.get_user_by_username(username))['user_id']
-
-                if role == "governorate_admin":
-                    await db.add_governorate_admin(user_id, st.session_state.add_user_form_data['governorate_id'])
-
-                if role != "admin" and st.session_state.add_user_form_data['allowed_surveys']:
-                    await db.update_user_allowed_surveys(user_id, st.session_state.add_user_form_data['allowed_surveys'])
+            # إضافة المستخدم وصلاحياته كمعاملة واحدة
+            try:
+                async with db.unit_of_work() as uow:
+                    user_id = await db.add_user(username, password, role,
+                                                st.session_state.add_user_form_data['admin_id'], uow=uow)
+                    if user_id and role == "governorate_admin":
+                        await db.add_governorate_admin(user_id, st.session_state.add_user_form_data['governorate_id'],
+                                                       uow=uow)
+                    if user_id and role != "admin" and st.session_state.add_user_form_data['allowed_surveys']:
+                        await db.update_user_allowed_surveys(user_id, st.session_state.add_user_form_data['allowed_surveys'],
+                                                             uow=uow)
+            except Exception as e:
+                st.error(f"حدث خطأ في إضافة المستخدم: {str(e)}")
+                return
 
+            if user_id:
                 st.success(f"تمت إضافة المستخدم {username} بنجاح")
                 st.session_state.add_user_form_data = {
                     'username': '',
@@ -212,32 +359,42 @@ async def add_user_form():
             }
             st.rerun()
 
+@async_fragment
 async def edit_user_form(user_id):
-    user = await db.d1.fetch_one('''
-        SELECT username, role, assigned_region 
-        FROM Users 
-        WHERE user_id=?
-    ''', (user_id,))
+    if st.session_state.get('editing_user') != user_id:
+        return
+
+    data = await load_all(
+        user=db.d1.fetch_one('''
+            SELECT username, role, assigned_region 
+            FROM Users 
+            WHERE user_id=?
+        ''', (user_id,)),
+        governorates=db.get_governorates_list(),
+        surveys=db.d1.fetch_all("SELECT survey_id, survey_name FROM Surveys"),
+        allowed_surveys=db.d1.fetch_all('''
+            SELECT survey_id FROM UserSurveys WHERE user_id=?
+        ''', (user_id,)),
+        gov_info=db.d1.fetch_one('''
+            SELECT governorate_id FROM GovernorateAdmins 
+            WHERE user_id=?
+        ''', (user_id,))
+    )
+    user = data['user']
     
     if user is None:
         st.error("المستخدم غير موجود!")
         del st.session_state.editing_user
         return
         
-    governorates = await db.get_governorates_list()
-    surveys = await db.d1.fetch_all("SELECT survey_id, survey_name FROM Surveys")
-    allowed_surveys = await db.d1.fetch_all('''
-        SELECT survey_id FROM UserSurveys WHERE user_id=?
-    ''', (user_id,))
-    allowed_surveys = [s[0] for s in allowed_surveys]
+    governorates = data['governorates']
+    surveys = data['surveys']
+    allowed_surveys = [s[0] for s in data['allowed_surveys']]
     
     current_gov = None
     current_admin = user[2]
     if user[1] == 'governorate_admin':
-        gov_info = await db.d1.fetch_one('''
-            SELECT governorate_id FROM GovernorateAdmins 
-            WHERE user_id=?
-        ''', (user_id,))
+        gov_info = data['gov_info']
         current_gov = gov_info[0] if gov_info else None
     
     with st.form(f"edit_user_{user_id}"):
@@ -296,25 +453,29 @@ async def edit_user_form(user_id):
         col1, col2 = st.columns(2)
         with col1:
             if st.form_submit_button("حفظ التعديلات"):
-                if new_role == "governorate_admin":
-                    await db.update_user(user_id, new_username, new_role)
-                    await db.d1.execute("DELETE FROM GovernorateAdmins WHERE user_id=?", (user_id,))
-                    await db.d1.execute(
-                        "INSERT INTO GovernorateAdmins (user_id, governorate_id) VALUES (?, ?)",
-                        (user_id, selected_gov)
-                    )
-                    if new_role != "admin":
-                        await db.update_user_allowed_surveys(user_id, selected_surveys)
-                else:
-                    await db.update_user(user_id, new_username, new_role, selected_admin if new_role == "employee" else None)
-                    if new_role != "admin":
-                        await db.update_user_allowed_surveys(user_id, selected_surveys)
-                del st.session_state.editing_user
-                st.rerun()
+                # حفظ بيانات المستخدم ومحافظته وصلاحياته كمعاملة واحدة
+                try:
+                    async with db.unit_of_work() as uow:
+                        saved = await db.update_user(
+                            user_id, new_username, new_role,
+                            selected_admin if new_role == "employee" else None, uow=uow
+                        )
+                        if saved and new_role == "governorate_admin":
+                            await db.add_governorate_admin(user_id, selected_gov, uow=uow)
+                        if saved and new_role != "admin" and surveys:
+                            await db.update_user_allowed_surveys(user_id, selected_surveys, uow=uow)
+                except Exception as e:
+                    st.error(f"حدث خطأ في تحديث المستخدم: {str(e)}")
+                    saved = False
+                
+                if saved:
+                    st.success("تم تحديث بيانات المستخدم بنجاح")
+                    del st.session_state.editing_user
+                    rerun_fragment()
         with col2:
             if st.form_submit_button("إلغاء"):
                 del st.session_state.editing_user
-                st.rerun()
+                rerun_fragment()
 
 async def delete_user(user_id):
     try:
@@ -357,7 +518,7 @@ async def manage_surveys():
         await create_survey_form()
 
 async def edit_survey(survey_id):
-    survey = await db.d1.fetch_one("SELECT survey_name, is_active FROM Surveys WHERE survey_id=?", (survey_id,))
+    survey = await db.get_survey_info(survey_id)
     fields = await db.get_survey_fields(survey_id)
     
     if 'new_survey_fields' not in st.session_state:
@@ -384,6 +545,8 @@ async def edit_survey(survey_id):
                     )
                 with col2:
                     new_required = st.checkbox("مطلوب", value=bool(field[4]), key=f"required_{field_id}")
+                    new_page = st.number_input("رقم الصفحة", min_value=1, step=1,
+                                               value=int(field[6] or 1), key=f"page_{field_id}")
                     if new_type == 'dropdown':
                         options = "\n".join(json.loads(field[3])) if field[3] else ""
                         new_options = st.text_area(
@@ -399,7 +562,8 @@ async def edit_survey(survey_id):
                     'field_label': new_label,
                     'field_type': new_type,
                     'field_options': [opt.strip() for opt in new_options.split('\n')] if new_options else None,
-                    'is_required': new_required
+                    'is_required': new_required,
+                    'page_number': int(new_page)
                 })
         
         st.subheader("إضافة حقول جديدة")
@@ -420,6 +584,9 @@ async def edit_survey(survey_id):
                 field['is_required'] = st.checkbox("مطلوب", 
                                                  value=field.get('is_required', False),
                                                  key=f"new_required_{i}")
+                field['page_number'] = int(st.number_input("رقم الصفحة", min_value=1, step=1,
+                                                           value=field.get('page_number', 1),
+                                                           key=f"new_page_{i}"))
                 if field['field_type'] == 'dropdown':
                     options = st.text_area(
                         "خيارات القائمة المنسدلة (سطر لكل خيار)",
@@ -435,7 +602,8 @@ async def edit_survey(survey_id):
                     'field_label': '',
                     'field_type': 'text',
                     'is_required': False,
-                    'field_options': []
+                    'field_options': [],
+                    'page_number': 1
                 })
                 st.rerun()
         with col2:
@@ -487,6 +655,9 @@ async def create_survey_form():
                 )
             with col2:
                 field['is_required'] = st.checkbox("مطلوب", value=field.get('is_required', False), key=f"new_required_{i}")
+                field['page_number'] = int(st.number_input("رقم الصفحة", min_value=1, step=1,
+                                                           value=field.get('page_number', 1),
+                                                           key=f"new_page_{i}"))
                 if field['field_type'] == 'dropdown':
                     options = st.text_area(
                         "خيارات القائمة المنسدلة (سطر لكل خيار)",
@@ -502,7 +673,8 @@ async def create_survey_form():
                     'field_label': '',
                     'field_type': 'text',
                     'is_required': False,
-                    'field_options': []
+                    'field_options': [],
+                    'page_number': 1
                 })
         with col2:
             if st.form_submit_button("حذف آخر حقل") and st.session_state.create_survey_fields:
@@ -514,193 +686,41 @@ async def create_survey_form():
                 st.rerun()
 
 async def display_survey_data(survey_id):
-    survey_name = await db.d1.fetch_one(
-        "SELECT survey_name FROM Surveys WHERE survey_id = ?", 
-        (survey_id,)
-    )
+    survey_info = await db.get_survey_info(survey_id)
     
-    if not survey_name:
+    if not survey_info:
         st.error("الاستبيان المحدد غير موجود")
         return
         
-    survey_name = survey_name[0]
+    survey_name = survey_info[0]
     st.subheader(f"بيانات الاستبيان: {survey_name}")
 
-    total_responses = await db.d1.fetch_one(
-        "SELECT COUNT(*) FROM Responses WHERE survey_id = ?", 
-        (survey_id,)
-    )
-    total_responses = total_responses[0] if total_responses else 0
+    version = await db.get_survey_data_version(survey_id)
+    total_responses = (await load_response_stats(survey_id, {}, version))[0]
 
     if total_responses == 0:
         st.info("لا توجد بيانات متاحة لهذا الاستبيان بعد")
         return
 
-    responses = await db.d1.fetch_all('''
-        SELECT r.response_id, u.username, h.admin_name, g.governorate_name,
-               r.submission_date, r.is_completed
-        FROM Responses r
-        JOIN Users u ON r.user_id = u.user_id
-        JOIN HealthAdministrations h ON r.region_id = h.admin_id
-        JOIN Governorates g ON h.governorate_id = g.governorate_id
-        WHERE r.survey_id = ?
-        ORDER BY r.submission_date DESC
-    ''', (survey_id,))
-
-    completed_responses = sum(1 for r in responses if r[5])
-    regions_count = len(set(r[2] for r in responses))
+    filters = await show_response_filters(f"responses_{survey_id}")
+    filtered_total, completed_responses, regions_count = await load_response_stats(survey_id, filters, version)
 
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("إجمالي الإجابات", total_responses)
+        st.metric("إجمالي الإجابات", filtered_total)
     with col2:
         st.metric("الإجابات المكتملة", completed_responses)
     with col3:
         st.metric("عدد المناطق", regions_count)
 
-    df = pd.DataFrame(
-        [(r[0], r[1], r[2], r[3], r[4], "مكتملة" if r[5] else "مسودة") for r in responses],
-        columns=["ID", "المستخدم", "الإدارة الصحية", "المحافظة", "تاريخ التقديم", "الحالة"]
+    selected_response_id = await show_response_page(
+        survey_id, filters, filtered_total, f"responses_{survey_id}", version=version
     )
     
-    st.dataframe(df)
-    
-    if st.button("تصدير شامل لجميع البيانات إلى Excel", key=f"export_excel_{survey_id}"):
-        import re
-        from io import BytesIO
-        
-        filename = re.sub(r'[^\w\-_]', '_', survey_name) + "_كامل_" + datetime.now().strftime("%Y%m%d_%H%M") + ".xlsx"
-        
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='ملخص_الإجابات', index=False)
-            
-            all_details = []
-            for response in responses:
-                details = await db.d1.fetch_all('''
-                    SELECT sf.field_label, rd.answer_value, 
-                           u.username as entered_by, 
-                           r.submission_date as entry_date,
-                           r.is_completed
-                    FROM Response_Details rd
-                    JOIN Survey_Fields sf ON rd.field_id = sf.field_id
-                    JOIN Responses r ON rd.response_id = r.response_id
-                    JOIN Users u ON r.user_id = u.user_id
-                    WHERE rd.response_id = ?
-                    ORDER BY sf.field_order
-                ''', (response[0],))
-                
-                for detail in details:
-                    all_details.append({
-                        "ID الإجابة": response[0],
-                        "الحقل": detail[0],
-                        "القيمة": detail[1],
-                        "أدخلها": detail[2],
-                        "تاريخ الإدخال": detail[3],
-                        "حالة الإجابة": "مكتملة" if detail[4] else "مسودة"
-                    })
-            
-            if all_details:
-                details_df = pd.DataFrame(all_details)
-                details_df.to_excel(writer, sheet_name='تفاصيل_الإجابات', index=False)
-            
-            fields = await db.d1.fetch_all('''
-                SELECT field_label, field_type, field_options, is_required
-                FROM Survey_Fields
-                WHERE survey_id = ?
-                ORDER BY field_order
-            ''', (survey_id,))
-            
-            fields_df = pd.DataFrame(
-                [(f[0], f[1], json.loads(f[2]) if f[2] else None, "نعم" if f[3] else "لا") for f in fields],
-                columns=["اسم الحقل", "نوع الحقل", "الخيارات", "مطلوب"]
-            )
-            fields_df.to_excel(writer, sheet_name='حقول_الاستبيان', index=False)
-            
-            users_df = pd.DataFrame(
-                [(r[1], r[2], r[3], r[4], "مكتملة" if r[5] else "مسودة") for r in responses],
-                columns=["المستخدم", "الإدارة الصحية", "المحافظة", "تاريخ التقديم", "الحالة"]
-            )
-            users_df.drop_duplicates().to_excel(writer, sheet_name='المستخدمين', index=False)
-   
-        with open(filename, "rb") as f:
-            st.download_button(
-                label="تنزيل ملف Excel الكامل",
-                data=f,
-                file_name=filename,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                key=f"download_excel_{survey_id}"
-            )
-        st.success("تم إنشاء ملف Excel الشامل بنجاح")
-
-    selected_response_id = st.selectbox(
-        "اختر إجابة لعرض وتعديل تفاصيلها",
-        options=[r[0] for r in responses],
-        format_func=lambda x: f"إجابة #{x}",
-        key=f"select_response_{survey_id}"
-    )
+    await show_export_controls(survey_id, survey_name)
 
     if selected_response_id:
-        response_info = await db.get_response_info(selected_response_id)
-        if response_info:
-            st.subheader(f"تفاصيل الإجابة #{selected_response_id}")
-            st.markdown(f"""
-            **الاستبيان:** {response_info[1]}  
-            **المستخدم:** {response_info[2]}  
-            **الإدارة الصحية:** {response_info[3]}  
-            **المحافظة:** {response_info[4]}  
-            **تاريخ التقديم:** {response_info[5]}
-            """)
-            
-            details = await db.get_response_details(selected_response_id)
-            updates = {}
-            
-            with st.form(key=f"edit_response_form_{selected_response_id}"):
-                for detail in details:
-                    detail_id, field_id, label, field_type, options, answer = detail
-                    
-                    col1, col2 = st.columns([1, 3])
-                    with col1:
-                        st.markdown(f"**{label}**")
-                    with col2:
-                        if field_type == 'dropdown':
-                            options_list = json.loads(options) if options else []
-                            new_value = st.selectbox(
-                                label,
-                                options_list,
-                                index=options_list.index(answer) if answer in options_list else 0,
-                                key=f"dropdown_{detail_id}_{selected_response_id}"
-                            )
-                        else:
-                            new_value = st.text_input(
-                                label,
-                                value=answer,
-                                key=f"input_{detail_id}_{selected_response_id}"
-                            )
-                        
-                        if new_value != answer:
-                            updates[detail_id] = new_value
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    save_clicked = st.form_submit_button("💾 حفظ جميع التعديلات")
-                    if save_clicked:
-                        if updates:
-                            success_count = 0
-                            for detail_id, new_value in updates.items():
-                                if await db.update_response_detail(detail_id, new_value):
-                                    success_count += 1
-                            
-                            if success_count == len(updates):
-                                st.success("تم تحديث جميع التعديلات بنجاح")
-                            else:
-                                st.error(f"تم تحديث {success_count} من أصل {len(updates)} تعديلات")
-                            st.rerun()
-                        else:
-                            st.info("لم تقم بإجراء أي تعديلات")
-                with col2:
-                    cancel_clicked = st.form_submit_button("❌ إلغاء التعديلات")
-                    if cancel_clicked:
-                        st.rerun()
+        show_response_editor(selected_response_id, f"admin_{survey_id}")
 
 async def view_data():
     st.header("عرض البيانات المجمعة")
@@ -723,6 +743,62 @@ async def view_data():
     if selected_survey:
         await display_survey_data(selected_survey[0])
 
+async def show_outbox_status():
+    st.header("صندوق الإرسال")
+    st.caption("الاستبيانات المكتملة التي تم استلامها من الموظفين ولم تُحفظ في قاعدة البيانات بعد")
+    
+    stats = submission_outbox.stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("في الانتظار", stats['depth'])
+    col2.metric("قيد إعادة المحاولة", stats['retrying'])
+    col3.metric("أقدم استبيان (UTC)", stats['oldest_submitted_at'] or "-")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("🔄 تحديث", key="outbox_refresh"):
+            st.rerun()
+    with col2:
+        if st.button("📤 إرسال الآن", key="outbox_drain", disabled=not stats['depth']):
+            submission_outbox.wake()
+            st.rerun()
+    
+    pending = submission_outbox.list_pending()
+    if pending:
+        st.dataframe(
+            pd.DataFrame(pending, columns=["مفتاح الإرسال", "المستخدم", "الاستبيان", "وقت الإرسال",
+                                           "عدد المحاولات", "آخر خطأ"]),
+            use_container_width=True,
+            hide_index=True
+        )
+
+async def show_database_load():
+    st.header("حمل قاعدة البيانات")
+    admission = db.d1.admission
+    st.caption(
+        f"الحد الأقصى للطلبات المتزامنة: {admission.max_concurrent} "
+        f"(منها {admission.bulk_limit} للعمليات المجمعة)، "
+        f"والحد الأقصى للمنتظرين لكل فئة قراءة: {admission.max_queued}"
+    )
+    
+    stats = pd.DataFrame(admission.stats())
+    col1, col2, col3 = st.columns(3)
+    col1.metric("طلبات جارية", int(stats['active'].sum()))
+    col2.metric("في قائمة الانتظار", int(stats['queued'].sum()))
+    col3.metric("طلبات مرفوضة", int(stats['rejected'].sum()))
+    
+    st.dataframe(
+        stats.drop(columns=['priority']).rename(columns={
+            'name': "الفئة", 'active': "جارية", 'queued': "منتظرة", 'admitted': "مقبولة",
+            'rejected': "مرفوضة", 'avg_wait_ms': "متوسط الانتظار (مللي ثانية)",
+            'max_wait_ms': "أقصى انتظار (مللي ثانية)"
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    if st.button("🔄 تحديث", key="database_load_refresh"):
+        st.rerun()
+
 async def manage_governorates():
     st.header("إدارة المحافظات")
     governorates = await db.d1.fetch_all("SELECT governorate_id, governorate_name, description FROM Governorates")
@@ -742,7 +818,7 @@ async def manage_governorates():
                 st.rerun()
     
     if 'editing_gov' in st.session_state:
-        await edit_governorate(st.session_state.editing_gov)
+        edit_governorate(st.session_state.editing_gov)
     
     with st.expander("إضافة محافظة جديدة"):
         with st.form("add_governorate_form"):
@@ -767,7 +843,11 @@ async def manage_governorates():
                 else:
                     st.warning("يرجى إدخال اسم المحافظة")
 
+@async_fragment
 async def edit_governorate(gov_id):
+    if st.session_state.get('editing_gov') != gov_id:
+        return
+
     gov = await db.d1.fetch_one("SELECT governorate_name, description FROM Governorates WHERE governorate_id=?", 
                               (gov_id,))
     
@@ -789,11 +869,11 @@ async def edit_governorate(gov_id):
                     )
                     st.success("تم تحديث المحافظة بنجاح")
                     del st.session_state.editing_gov
-                    st.rerun()
+                    rerun_fragment()
         with col2:
             if st.form_submit_button("إلغاء"):
                 del st.session_state.editing_gov
-                st.rerun()
+                rerun_fragment()
 
 async def delete_governorate(gov_id):
     try:
@@ -1,5 +1,6 @@
 import asyncio
 import os
+from datetime import datetime
 from dotenv import load_dotenv
 import streamlit as st
 
@@ -14,9 +15,14 @@ async def main():
     from employee_views import show_employee_dashboard
     from governorate_admin_views import show_governorate_admin_dashboard
     
+    from outbox import submission_outbox
+    
     # تهيئة قاعدة البيانات
     await db.init_db()
     
+    # إرسال الاستبيانات المتبقية في صندوق الإرسال من تشغيل سابق
+    submission_outbox.start()
+    
     # التحقق من حالة الجلسة
     if await authenticate():
         st.session_state.last_activity = datetime.now()
@@ -32,4 +38,6 @@ async def main():
             await show_employee_dashboard()
 
 if __name__ == "__main__":
+    # واجهة كل جلسة تعمل في خيط السكربت الخاص بها لأن سياق Streamlit مرتبط بالخيط،
+    # بينما الاتصالات والمهام الطويلة تعيش على الحلقة المشتركة في event_loop
     asyncio.run(main())
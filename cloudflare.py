@@ -1,6 +1,132 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
 import os
+import re
+import time
 import httpx
-from typing import List, Tuple, Dict, Any, Optional
+from contextlib import contextmanager
+from typing import Awaitable, Callable, List, Tuple, Dict, Any, Optional, Set
+from event_loop import background_loop
+
+# فئات أولوية طلبات قاعدة البيانات؛ الرقم الأصغر يُخدم أولاً
+PRIORITY_WRITE = 0
+PRIORITY_READ = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_WRITE: "كتابة تفاعلية", PRIORITY_READ: "قراءة تفاعلية", PRIORITY_BULK: "عمليات مجمعة"}
+
+# أولوية محددة صراحة للكود الحالي، وإلا تُستنتج من نوع الاستعلام
+_request_priority: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('d1_priority', default=None)
+
+@contextmanager
+def d1_priority(priority: int):
+    """تشغيل طلبات قاعدة البيانات داخل الكتلة بأولوية محددة.
+    مثال: with d1_priority(PRIORITY_BULK): await export()"""
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+# الجداول التي يكتب فيها استعلام، لإبلاغ الذاكرة المؤقتة بما تغير
+_WRITTEN_TABLE = re.compile(
+    r"\b(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|(?<!DO\s)UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(\w+)",
+    re.IGNORECASE)
+
+def written_tables(sqls: List[str]) -> Set[str]:
+    """أسماء الجداول التي تعدلها الاستعلامات"""
+    return {table for sql in sqls for table in _WRITTEN_TABLE.findall(sql)}
+
+class D1Overloaded(Exception):
+    """رفض طلب لأن قائمة انتظار فئته ممتلئة"""
+
+class AdmissionController:
+    """تحديد عدد طلبات قاعدة البيانات المتزامنة وخدمة المنتظرين حسب الأولوية.
+    يعمل بالكامل على الحلقة المشتركة"""
+
+    def __init__(self, max_concurrent: int = 8, max_queued: int = 200, bulk_share: float = 0.5):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        # العمليات المجمعة لا تشغل كل الاتصالات حتى يجد الإرسال التفاعلي مكاناً دائماً
+        self.bulk_limit = max(1, int(max_concurrent * bulk_share))
+        self._waiters: List[tuple] = []
+        self._sequence = itertools.count()
+        self._active = {priority: 0 for priority in PRIORITY_NAMES}
+        self._queued = {priority: 0 for priority in PRIORITY_NAMES}
+        self._admitted = {priority: 0 for priority in PRIORITY_NAMES}
+        self._rejected = {priority: 0 for priority in PRIORITY_NAMES}
+        self._wait_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._wait_max = {priority: 0.0 for priority in PRIORITY_NAMES}
+
+    def _can_run(self, priority: int) -> bool:
+        if sum(self._active.values()) >= self.max_concurrent:
+            return False
+        return priority != PRIORITY_BULK or self._active[PRIORITY_BULK] < self.bulk_limit
+
+    def _admit(self, priority: int, waited: float):
+        self._active[priority] += 1
+        self._admitted[priority] += 1
+        self._wait_total[priority] += waited
+        self._wait_max[priority] = max(self._wait_max[priority], waited)
+
+    async def acquire(self, priority: int):
+        """انتظار دور الطلب؛ الكتابة لا تُرفض أبداً والقراءة تُرفض عند امتلاء قائمتها"""
+        if self._can_run(priority) and (not self._waiters or self._waiters[0][0] > priority):
+            self._admit(priority, 0.0)
+            return
+
+        if priority != PRIORITY_WRITE and self._queued[priority] >= self.max_queued:
+            self._rejected[priority] += 1
+            raise D1Overloaded("قاعدة البيانات مشغولة حالياً، يرجى المحاولة بعد قليل")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future, time.monotonic())
+        heapq.heappush(self._waiters, entry)
+        self._queued[priority] += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # أُلغي الطلب بعد قبوله مباشرة، فيُعاد مكانه لغيره
+                self.release(priority)
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._queued[priority] -= 1
+            raise
+
+    def release(self, priority: int):
+        """تحرير مكان الطلب وقبول المنتظرين حسب أولويتهم"""
+        self._active[priority] -= 1
+        now = time.monotonic()
+        while self._waiters:
+            waiter_priority, _, future, queued_at = self._waiters[0]
+            if future.cancelled():
+                heapq.heappop(self._waiters)
+                self._queued[waiter_priority] -= 1
+                continue
+            # المنتظرون مرتبون حسب الأولوية، فإذا تعذر قبول الأول تعذر قبول من بعده
+            if not self._can_run(waiter_priority):
+                break
+            heapq.heappop(self._waiters)
+            self._queued[waiter_priority] -= 1
+            self._admit(waiter_priority, now - queued_at)
+            future.set_result(None)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """لكل فئة: الطلبات الجارية والمنتظرة والمقبولة والمرفوضة ومتوسط وأقصى انتظار بالمللي ثانية"""
+        return [{
+            'priority': priority,
+            'name': name,
+            'active': self._active[priority],
+            'queued': self._queued[priority],
+            'admitted': self._admitted[priority],
+            'rejected': self._rejected[priority],
+            'avg_wait_ms': round(1000 * self._wait_total[priority] / self._admitted[priority], 1)
+                           if self._admitted[priority] else 0.0,
+            'max_wait_ms': round(1000 * self._wait_max[priority], 1)
+        } for priority, name in PRIORITY_NAMES.items()]
 
 class CloudflareD1:
     def __init__(self, account_id: str, api_token: str, database_id: str):
@@ -12,21 +138,57 @@ class CloudflareD1:
             "Authorization": f"Bearer {self.api_token}",
             "Content-Type": "application/json"
         }
+        # عميل HTTP واحد باتصالات مُعاد استخدامها يعيش على الحلقة المشتركة
+        self._client: Optional[httpx.AsyncClient] = None
+        self.admission = AdmissionController(
+            int(os.getenv('D1_MAX_CONCURRENT', '8')),
+            int(os.getenv('D1_MAX_QUEUED', '200'))
+        )
+        # يُنتظر بأسماء الجداول بعد كل كتابة ناجحة
+        self.on_write: Optional[Callable[[Set[str]], Awaitable[None]]] = None
     
-    async def execute(self, sql: str, params: tuple = ()) -> Dict[str, Any]:
-        """تنفيذ استعلام SQL مع أو بدون معاملات"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/query",
-                headers=self.headers,
-                json={
-                    "sql": sql,
-                    "params": params
-                }
-            )
+    @staticmethod
+    def _priority(sqls: List[str]) -> int:
+        priority = _request_priority.get()
+        if priority is not None:
+            return priority
+        is_read = all(sql.lstrip().upper().startswith(("SELECT", "WITH")) for sql in sqls)
+        return PRIORITY_READ if is_read else PRIORITY_WRITE
+    
+    async def _post(self, body: Dict[str, Any], priority: int) -> List[Dict[str, Any]]:
+        await self.admission.acquire(priority)
+        try:
+            if self._client is None:
+                self._client = httpx.AsyncClient(headers=self.headers, timeout=30)
+            response = await self._client.post(f"{self.base_url}/query", json=body)
             response.raise_for_status()
             return response.json().get("result", [])
+        finally:
+            self.admission.release(priority)
     
+    async def _written(self, sqls: List[str]):
+        if self.on_write is not None:
+            tables = written_tables(sqls)
+            if tables:
+                await self.on_write(tables)
+    
+    async def execute(self, sql: str, params: tuple = ()) -> Dict[str, Any]:
+        """تنفيذ استعلام SQL مع أو بدون معاملات"""
+        result = await background_loop.call(self._post({
+            "sql": sql,
+            "params": params
+        }, self._priority([sql])))
+        await self._written([sql])
+        return result
+    
+    async def batch(self, statements: List[Tuple[str, tuple]]) -> List[List[Tuple]]:
+        """تنفيذ عدة استعلامات في طلب واحد كمعاملة واحدة وإرجاع نتائج كل استعلام"""
+        result = await background_loop.call(self._post({
+            "batch": [{"sql": sql, "params": list(params)} for sql, params in statements]
+        }, self._priority([sql for sql, _ in statements])))
+        await self._written([sql for sql, _ in statements])
+        return [[tuple(row.values()) for row in item.get("results", [])] for item in result]
+
     async def fetch_one(self, sql: str, params: tuple = ()) -> Optional[Tuple]:
         """جلب سجل واحد من قاعدة البيانات"""
         result = await self.execute(sql, params)
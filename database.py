@@ -5,6 +5,65 @@ from datetime import datetime
 from pathlib import Path
 import os
 from cloudflare import CloudflareD1
+from write_behind import write_behind
+from loaders import request_loader
+from shared_cache import shared_cache
+
+# الحد الأقصى لعدد المعاملات في استعلام واحد على D1
+D1_MAX_PARAMS = 100
+
+def chunked(items, size):
+    """تقسيم قائمة إلى دفعات بحجم محدد"""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class SqlRef:
+    """قيمة تُحسب داخل الدفعة نفسها، مثل معرف مستخدم أضيف في خطوة سابقة من وحدة العمل"""
+
+    def __init__(self, sql, params=()):
+        self.sql = sql
+        self.params = tuple(params)
+
+def bind(value):
+    """إرجاع نص المعامل وقيمه لقيمة عادية أو لمرجع داخل الدفعة"""
+    if isinstance(value, SqlRef):
+        return f"({value.sql})", list(value.params)
+    return "?", [value]
+
+class UnitOfWork:
+    """تجميع عمليات الكتابة من عدة دوال وتنفيذها كمعاملة واحدة في طلب واحد"""
+
+    def __init__(self, d1):
+        self._d1 = d1
+        self._statements = []
+        self._after_commit = []
+        self.results = []
+
+    def add(self, sql, params=()):
+        """إضافة استعلام إلى الدفعة وإرجاع ترتيبه في النتائج"""
+        self._statements.append((sql, tuple(params)))
+        return len(self._statements) - 1
+
+    def after_commit(self, callback):
+        """تنفيذ دالة بعد نجاح حفظ الدفعة فقط"""
+        self._after_commit.append(callback)
+
+    async def commit(self):
+        if self._statements:
+            self.results = await self._d1.batch(self._statements)
+        self._statements = []
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.commit()
+        return False
 
 class Database:
     def __init__(self):
@@ -13,6 +72,8 @@ class Database:
     api_token=os.getenv('CF_API_TOKEN'),
     database_id=os.getenv('CF_D1_DATABASE_ID')
 )
+        # أي كتابة من هذه العملية تلغي البيانات المشتركة المعتمدة على الجداول المعدلة في جميع العمليات
+        self.d1.on_write = shared_cache.invalidate
     
     async def init_db(self):
         """تهيئة الجداول في قاعدة البيانات"""
@@ -26,6 +87,7 @@ class Database:
                 assigned_region INTEGER,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 last_login TIMESTAMP,
+                last_activity TIMESTAMP,
                 FOREIGN KEY(assigned_region) REFERENCES Regions(region_id)
             )
             """,
@@ -65,6 +127,7 @@ class Database:
                 field_options TEXT,
                 is_required BOOLEAN DEFAULT FALSE,
                 field_order INTEGER NOT NULL,
+                page_number INTEGER NOT NULL DEFAULT 1,
                 FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id)
             )
             """,
@@ -76,6 +139,8 @@ class Database:
                 region_id INTEGER NOT NULL,
                 submission_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 is_completed BOOLEAN DEFAULT FALSE,
+                row_version INTEGER NOT NULL DEFAULT 0,
+                submission_key TEXT,
                 FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id),
                 FOREIGN KEY(user_id) REFERENCES Users(user_id),
                 FOREIGN KEY(region_id) REFERENCES Regions(region_id)
@@ -133,11 +198,88 @@ class Database:
                 action_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(user_id) REFERENCES Users(user_id)
             )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS SurveyDataVersions (
+                survey_id INTEGER PRIMARY KEY,
+                responses_version INTEGER NOT NULL DEFAULT 0,
+                details_version INTEGER NOT NULL DEFAULT 0,
+                fields_version INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY(survey_id) REFERENCES Surveys(survey_id)
+            )
             """
         ]
 
         for table in tables:
             await self.d1.execute(table)
+
+        # أعمدة أضيفت بعد إنشاء الجداول في قواعد البيانات القائمة
+        migrations = [
+            "ALTER TABLE Survey_Fields ADD COLUMN page_number INTEGER NOT NULL DEFAULT 1",
+            "ALTER TABLE Responses ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE Responses ADD COLUMN submission_key TEXT",
+            "ALTER TABLE Users ADD COLUMN last_activity TIMESTAMP",
+            "ALTER TABLE SurveyDataVersions ADD COLUMN fields_version INTEGER NOT NULL DEFAULT 0"
+        ]
+
+        for migration in migrations:
+            try:
+                await self.d1.execute(migration)
+            except Exception:
+                # العمود موجود بالفعل
+                pass
+
+        indexes = [
+            "CREATE INDEX IF NOT EXISTS idx_responses_survey ON Responses(survey_id, response_id)",
+            "CREATE INDEX IF NOT EXISTS idx_responses_survey_date ON Responses(survey_id, submission_date, response_id)",
+            "CREATE INDEX IF NOT EXISTS idx_response_details_response ON Response_Details(response_id)",
+            # يغطي فحص الإكمال في يوم محدد لكل (مستخدم، استبيان) ويحل محل الفهرس السابق بدون التاريخ
+            "DROP INDEX IF EXISTS idx_responses_user_survey",
+            "CREATE INDEX IF NOT EXISTS idx_responses_user_survey_date ON Responses(user_id, survey_id, is_completed, submission_date)",
+            "CREATE INDEX IF NOT EXISTS idx_users_assigned_region ON Users(assigned_region)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_responses_submission_key ON Responses(submission_key)"
+        ]
+
+        for index in indexes:
+            await self.d1.execute(index)
+
+        # عدادات تغيير لكل استبيان حتى تكتشف البيانات المخزنة التعديلات والحذف
+        triggers = [
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_responses_update AFTER UPDATE ON Responses
+            BEGIN
+                INSERT INTO SurveyDataVersions (survey_id, responses_version) VALUES (NEW.survey_id, 1)
+                ON CONFLICT(survey_id) DO UPDATE SET responses_version = responses_version + 1;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_responses_delete AFTER DELETE ON Responses
+            BEGIN
+                INSERT INTO SurveyDataVersions (survey_id, responses_version) VALUES (OLD.survey_id, 1)
+                ON CONFLICT(survey_id) DO UPDATE SET responses_version = responses_version + 1;
+            END
+            """
+        ]
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            triggers.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_response_details_{event.lower()} AFTER {event} ON Response_Details
+            BEGIN
+                INSERT INTO SurveyDataVersions (survey_id, details_version)
+                SELECT survey_id, 1 FROM Responses WHERE response_id = {row}.response_id
+                ON CONFLICT(survey_id) DO UPDATE SET details_version = details_version + 1;
+            END
+            """)
+            # تغيير الحقول (إعادة تسمية أو إضافة أو حذف أو إعادة ترتيب) يغير أعمدة الملفات المصدرة
+            triggers.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_survey_fields_{event.lower()} AFTER {event} ON Survey_Fields
+            BEGIN
+                INSERT INTO SurveyDataVersions (survey_id, fields_version) VALUES ({row}.survey_id, 1)
+                ON CONFLICT(survey_id) DO UPDATE SET fields_version = fields_version + 1;
+            END
+            """)
+
+        for trigger in triggers:
+            await self.d1.execute(trigger)
         
         # إضافة مستخدم admin افتراضي
         admin_count = await self.d1.fetch_one("SELECT COUNT(*) FROM Users WHERE role='admin'")
@@ -149,6 +291,10 @@ class Database:
                 ("admin", admin_password, "admin")
             )
 
+    def unit_of_work(self):
+        """بدء وحدة عمل تجمع عمليات الكتابة وتحفظها كمعاملة واحدة عند الخروج"""
+        return UnitOfWork(self.d1)
+
     async def get_user_by_username(self, username):
         """الحصول على بيانات المستخدم باستخدام اسم المستخدم"""
         user = await self.d1.fetch_one(
@@ -169,16 +315,31 @@ class Database:
 
     async def get_user_role(self, user_id):
         """الحصول على دور المستخدم"""
-        role = await self.d1.fetch_one(
-            "SELECT role FROM Users WHERE user_id=?", (user_id,)
-        )
-        return role[0] if role else None
+        return await request_loader('user_roles', self.get_user_roles, D1_MAX_PARAMS).load(user_id)
+
+    async def get_user_roles(self, user_ids):
+        """أدوار عدة مستخدمين باستعلام واحد لما ليس في الذاكرة المشتركة"""
+        async def load(missing):
+            rows = await self.d1.fetch_all(
+                f"SELECT user_id, role FROM Users WHERE user_id IN ({', '.join('?' * len(missing))})",
+                missing)
+            return dict(rows)
+        return await shared_cache.get_or_load_many('user_role', user_ids, ('Users',), load)
 
     async def get_health_admins(self):
         """استرجاع جميع الإدارات الصحية من قاعدة البيانات"""
-        return await self.d1.fetch_all(
+        return await shared_cache.get_or_load('health_admins', ('HealthAdministrations',), lambda: self.d1.fetch_all(
             "SELECT admin_id, admin_name FROM HealthAdministrations"
-        )
+        ))
+
+    async def get_health_admins_by_governorate(self, governorate_id):
+        """استرجاع الإدارات الصحية التابعة لمحافظة معينة"""
+        return await shared_cache.get_or_load(
+            f'health_admins_by_governorate:{governorate_id}', ('HealthAdministrations',), lambda: self.d1.fetch_all(
+            """SELECT admin_id, admin_name FROM HealthAdministrations
+               WHERE governorate_id = ?
+               ORDER BY admin_name""", (governorate_id,)
+        ))
 
     async def get_health_admin_name(self, admin_id):
         """استرجاع اسم الإدارة الصحية بناءً على المعرف"""
@@ -186,14 +347,21 @@ class Database:
             return "غير معين"
         
         try:
-            result = await self.d1.fetch_one(
-                "SELECT admin_name FROM HealthAdministrations WHERE admin_id=?", (admin_id,)
-            )
-            return result[0] if result else "غير معروف"
+            name = await request_loader(
+                'health_admin_names', self.get_health_admin_names, D1_MAX_PARAMS).load(admin_id)
+            return name if name is not None else "غير معروف"
         except Exception as e:
             print(f"خطأ في جلب اسم الإدارة الصحية: {e}")
             return "خطأ في النظام"
 
+    async def get_health_admin_names(self, admin_ids):
+        """أسماء عدة إدارات صحية باستعلام واحد"""
+        rows = await self.d1.fetch_all(
+            f"""SELECT admin_id, admin_name FROM HealthAdministrations
+                WHERE admin_id IN ({', '.join('?' * len(admin_ids))})""",
+            list(admin_ids))
+        return dict(rows)
+
     async def save_response(self, survey_id, user_id, region_id, is_completed=False):
         """حفظ استجابة جديدة في قاعدة البيانات"""
         try:
@@ -211,16 +379,140 @@ class Database:
     async def save_response_detail(self, response_id, field_id, answer_value):
         """حفظ تفاصيل الإجابة"""
         try:
-            await self.d1.execute(
-                """INSERT INTO Response_Details 
-                   (response_id, field_id, answer_value) 
-                   VALUES (?, ?, ?)""",
-                (response_id, field_id, str(answer_value) if answer_value is not None else ""))
+            await self.d1.batch([
+                ("""INSERT INTO Response_Details 
+                    (response_id, field_id, answer_value) 
+                    VALUES (?, ?, ?)""",
+                 (response_id, field_id, str(answer_value) if answer_value is not None else "")),
+                ("UPDATE Responses SET row_version = row_version + 1 WHERE response_id = ?", (response_id,))
+            ])
+            return True
+        except Exception as e:
+            st.error(f"حدث خطأ في حفظ تفاصيل الإجابة: {str(e)}")
+            return False
+
+    async def get_user_draft(self, user_id, survey_id):
+        """الحصول على آخر مسودة للمستخدم في الاستبيان مع إجاباتها"""
+        try:
+            rows = await self.d1.fetch_all(
+                """SELECT r.response_id, rd.field_id, rd.answer_value
+                   FROM Responses r
+                   LEFT JOIN Response_Details rd ON rd.response_id = r.response_id
+                   WHERE r.response_id = (
+                       SELECT MAX(response_id) FROM Responses
+                       WHERE user_id = ? AND survey_id = ? AND is_completed = 0
+                   )""", (user_id, survey_id))
+            if not rows:
+                return None
+            return rows[0][0], {r[1]: r[2] for r in rows if r[1] is not None}
+        except Exception as e:
+            st.error(f"حدث خطأ في جلب المسودة: {str(e)}")
+            return None
+
+    async def create_draft(self, survey_id, user_id, region_id):
+        """إنشاء مسودة جديدة وإرجاع معرفها"""
+        try:
+            result = await self.d1.fetch_one(
+                """INSERT INTO Responses (survey_id, user_id, region_id, is_completed)
+                   VALUES (?, ?, ?, FALSE)
+                   RETURNING response_id""",
+                (survey_id, user_id, region_id))
+            return result[0] if result else None
+        except Exception as e:
+            st.error(f"حدث خطأ في حفظ الاستجابة: {str(e)}")
+            return None
+
+    async def write_response_answers(self, response_id, answers, existing_field_ids=()):
+        """كتابة الإجابات المتغيرة فقط: تحديث الموجود منها وإضافة الجديد على دفعات"""
+        try:
+            await self._write_answers(response_id, answers, existing_field_ids)
             return True
         except Exception as e:
             st.error(f"حدث خطأ في حفظ تفاصيل الإجابة: {str(e)}")
             return False
 
+    async def _write_answers(self, response_id, answers, existing_field_ids=()):
+        existing_field_ids = set(existing_field_ids)
+        updates = [(f, v) for f, v in answers.items() if f in existing_field_ids]
+        inserts = [(response_id, f, v) for f, v in answers.items() if f not in existing_field_ids]
+        if not updates and not inserts:
+            return
+
+        async with self.unit_of_work() as uow:
+            for chunk in chunked(updates, (D1_MAX_PARAMS - 1) // 2):
+                uow.add(
+                    f"""UPDATE Response_Details SET answer_value = v.column2
+                        FROM (VALUES {', '.join(['(?, ?)'] * len(chunk))}) AS v
+                        WHERE Response_Details.field_id = v.column1
+                          AND Response_Details.response_id = ?""",
+                    [value for pair in chunk for value in pair] + [response_id])
+
+            for chunk in chunked(inserts, D1_MAX_PARAMS // 3):
+                uow.add(
+                    f"""INSERT INTO Response_Details (response_id, field_id, answer_value)
+                        VALUES {', '.join(['(?, ?, ?)'] * len(chunk))}""",
+                    [value for row in chunk for value in row])
+
+            # أي تغيير في الإجابات يرفع إصدار الإجابة حتى يُرفض تعديل محرر حمّل نسخة أقدم
+            uow.add("UPDATE Responses SET row_version = row_version + 1 WHERE response_id = ?", (response_id,))
+
+    def _add_submission(self, uow, submission):
+        """إضافة استعلامات تطبيق استبيان مكتمل إلى وحدة عمل وإرجاع ترتيب استعلام معرف الإجابة.
+        كل الاستعلامات معرّفة بمفتاح عدم التكرار، فلا تحتاج إلى قراءة مسبقة، وإعادة تنفيذها
+        بعد اكتمال الإجابة لا تغير شيئاً"""
+        key = submission['submission_key']
+        pending = "SELECT response_id FROM Responses WHERE submission_key = ? AND is_completed = 0"
+
+        # ربط المسودة بالمفتاح، أو إنشاء إجابة جديدة إذا لم تعد المسودة متاحة
+        if submission.get('response_id'):
+            uow.add("""UPDATE Responses SET submission_key = ?
+                       WHERE response_id = ? AND user_id = ? AND is_completed = 0
+                         AND submission_key IS NULL
+                         AND NOT EXISTS (SELECT 1 FROM Responses WHERE submission_key = ?)""",
+                    (key, submission['response_id'], submission['user_id'], key))
+        uow.add("""INSERT INTO Responses (survey_id, user_id, region_id, is_completed, submission_key)
+                   SELECT ?, ?, ?, FALSE, ?
+                   WHERE NOT EXISTS (SELECT 1 FROM Responses WHERE submission_key = ?)""",
+                (submission['survey_id'], submission['user_id'], submission['region_id'], key, key))
+
+        # تحديث الإجابات المتغيرة من المسودة ثم إضافة الحقول التي لم تُحفظ فيها
+        answers = [(int(field_id), value) for field_id, value in submission['answers'].items()]
+        for chunk in chunked(answers, (D1_MAX_PARAMS - 1) // 2):
+            values = ', '.join(['(?, ?)'] * len(chunk))
+            params = [value for pair in chunk for value in pair] + [key]
+            uow.add(f"""UPDATE Response_Details SET answer_value = v.column2
+                        FROM (VALUES {values}) AS v
+                        WHERE Response_Details.field_id = v.column1
+                          AND Response_Details.answer_value IS NOT v.column2
+                          AND Response_Details.response_id = ({pending})""", params)
+            uow.add(f"""INSERT INTO Response_Details (response_id, field_id, answer_value)
+                        SELECT r.response_id, v.column1, v.column2
+                        FROM (VALUES {values}) AS v
+                        JOIN Responses r ON r.response_id = ({pending})
+                        WHERE NOT EXISTS (SELECT 1 FROM Response_Details d
+                                          WHERE d.response_id = r.response_id AND d.field_id = v.column1)""",
+                    params)
+
+        # رفع الإصدار يغطي تغييرات الإجابات أعلاه لأنها لا تُكتب إلا مع الإكمال في نفس المعاملة
+        uow.add("""UPDATE Responses SET is_completed = TRUE, submission_date = ?, row_version = row_version + 1
+                   WHERE submission_key = ? AND is_completed = 0""",
+                (submission['submitted_at'], key))
+        return uow.add("SELECT response_id FROM Responses WHERE submission_key = ?", (key,))
+
+    async def apply_submission(self, submission):
+        """تطبيق استبيان مكتمل من صندوق الإرسال في معاملة واحدة؛ آمن لإعادة التنفيذ بنفس مفتاح
+        عدم التكرار. لا يلتقط الأخطاء حتى يعيد صندوق الإرسال المحاولة لاحقاً"""
+        async with self.unit_of_work() as uow:
+            result = self._add_submission(uow, submission)
+        return uow.results[result][0][0]
+
+    async def apply_submissions(self, submissions):
+        """تطبيق عدة استبيانات مكتملة في معاملة واحدة وطلب واحد وإرجاع معرفات إجاباتها بنفس الترتيب.
+        لا يلتقط الأخطاء؛ فشل أي استبيان يلغي الدفعة كلها"""
+        async with self.unit_of_work() as uow:
+            results = [self._add_submission(uow, submission) for submission in submissions]
+        return [uow.results[result][0][0] for result in results]
+
     async def save_survey(self, survey_name, fields, governorate_ids=None):
         """حفظ استبيان جديد مع حقوله في قاعدة البيانات"""
         try:
@@ -245,14 +537,15 @@ class Database:
                 
                 await self.d1.execute(
                     """INSERT INTO Survey_Fields 
-                       (survey_id, field_type, field_label, field_options, is_required, field_order) 
-                       VALUES (?, ?, ?, ?, ?, ?)""",
+                       (survey_id, field_type, field_label, field_options, is_required, field_order, page_number) 
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
                     (survey_id, 
                      field['field_type'], 
                      field['field_label'],
                      field_options,
                      field.get('is_required', False),
-                     i + 1)
+                     i + 1,
+                     field.get('page_number', 1))
                 )
             
             return True
@@ -261,18 +554,29 @@ class Database:
             return False
 
     async def update_last_login(self, user_id):
-        """تحديث وقت آخر دخول للمستخدم"""
-        await self.d1.execute(
-            "UPDATE Users SET last_login = CURRENT_TIMESTAMP WHERE user_id = ?", 
-            (user_id,)
-        )
+        """تحديث وقت آخر دخول للمستخدم (كتابة مؤجلة)"""
+        write_behind.touch_user("last_login", user_id)
 
     async def update_user_activity(self, user_id):
-        """تحديث وقت النشاط الأخير للمستخدم"""
-        await self.d1.execute(
-            "UPDATE Users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?", 
-            (user_id,)
-        )
+        """تحديث وقت النشاط الأخير للمستخدم (كتابة مؤجلة)"""
+        write_behind.touch_user("last_activity", user_id)
+
+    async def apply_write_behind(self, user_timestamps, audit_rows):
+        """كتابة دفعة من العمليات المؤجلة: تحديثات أوقات المستخدمين وسجلات التعديل"""
+        for column, users in user_timestamps.items():
+            for chunk in chunked(users.items(), D1_MAX_PARAMS // 2):
+                await self.d1.execute(
+                    f"""UPDATE Users SET {column} = v.column2
+                        FROM (VALUES {', '.join(['(?, ?)'] * len(chunk))}) AS v
+                        WHERE Users.user_id = v.column1""",
+                    [value for pair in chunk for value in pair])
+
+        for chunk in chunked(audit_rows, D1_MAX_PARAMS // 7):
+            await self.d1.execute(
+                f"""INSERT INTO AuditLog
+                    (user_id, action_type, table_name, record_id, old_value, new_value, action_timestamp)
+                    VALUES {', '.join(['(?, ?, ?, ?, ?, ?, ?)'] * len(chunk))}""",
+                [value for row in chunk for value in row])
 
     async def delete_survey(self, survey_id):
         """حذف استبيان وجميع بياناته المرتبطة"""
@@ -328,9 +632,9 @@ class Database:
 
     async def get_governorates_list(self):
         """استرجاع قائمة المحافظات للاستخدام في القوائم المنسدلة"""
-        return await self.d1.fetch_all(
+        return await shared_cache.get_or_load('governorates', ('Governorates',), lambda: self.d1.fetch_all(
             "SELECT governorate_id, governorate_name FROM Governorates"
-        )
+        ))
 
     async def update_survey(self, survey_id, survey_name, is_active, fields):
         """تحديث بيانات الاستبيان وحقوله"""
@@ -348,12 +652,13 @@ class Database:
                 if 'field_id' in field:  # حقل موجود يتم تحديثه
                     await self.d1.execute(
                         """UPDATE Survey_Fields 
-                           SET field_label=?, field_type=?, field_options=?, is_required=?
+                           SET field_label=?, field_type=?, field_options=?, is_required=?, page_number=?
                            WHERE field_id=?""",
                         (field['field_label'], 
                          field['field_type'],
                          field_options,
                          field.get('is_required', False),
+                         field.get('page_number', 1),
                          field['field_id'])
                     )
                 else:  # حقل جديد يتم إضافته
@@ -363,14 +668,15 @@ class Database:
                     
                     await self.d1.execute(
                         """INSERT INTO Survey_Fields 
-                           (survey_id, field_label, field_type, field_options, is_required, field_order) 
-                           VALUES (?, ?, ?, ?, ?, ?)""",
+                           (survey_id, field_label, field_type, field_options, is_required, field_order, page_number) 
+                           VALUES (?, ?, ?, ?, ?, ?, ?)""",
                         (survey_id,
                          field['field_label'],
                          field['field_type'],
                          field_options,
                          field.get('is_required', False),
-                         max_order + 1)
+                         max_order + 1,
+                         field.get('page_number', 1))
                     )
             
             st.success("تم تحديث الاستبيان بنجاح")
@@ -379,8 +685,8 @@ class Database:
             st.error(f"حدث خطأ في تحديث الاستبيان: {str(e)}")
             return False
 
-    async def update_user(self, user_id, username, role, region_id=None):
-        """تحديث بيانات المستخدم"""
+    async def update_user(self, user_id, username, role, region_id=None, uow=None):
+        """تحديث بيانات المستخدم، ضمن وحدة عمل إذا مُررت"""
         try:
             # الحصول على القيم القديمة أولاً
             old_data = await self.d1.fetch_one(
@@ -394,41 +700,33 @@ class Database:
                 st.error("اسم المستخدم موجود بالفعل!")
                 return False
             
+            batch = uow or self.unit_of_work()
+            
             # تحديث بيانات المستخدم
-            await self.d1.execute(
+            batch.add(
                 "UPDATE Users SET username=?, role=?, assigned_region=? WHERE user_id=?",
                 (username, role, region_id, user_id)
             )
             
             if role == 'governorate_admin':
-                await self.d1.execute(
-                    "DELETE FROM GovernorateAdmins WHERE user_id=?", (user_id,))
+                batch.add("DELETE FROM GovernorateAdmins WHERE user_id=?", (user_id,))
             
-            # تسجيل التعديل في سجل التعديلات
+            # تسجيل التعديل في سجل التعديلات بعد نجاح الحفظ
             new_data = (username, role, region_id)
-            changes = {
-                'username': {'old': old_data[0], 'new': new_data[0]},
-                'role': {'old': old_data[1], 'new': new_data[1]},
-                'assigned_region': {'old': old_data[2], 'new': new_data[2]}
-            }
-            
-            await self.log_audit_action(
-                st.session_state.user_id, 
-                'UPDATE', 
-                'Users', 
-                user_id,
-                old_data,
-                new_data
-            )
+            audit_user_id = st.session_state.user_id
+            batch.after_commit(lambda: write_behind.add_audit(
+                audit_user_id, 'UPDATE', 'Users', user_id, old_data, new_data))
             
-            st.success("تم تحديث بيانات المستخدم بنجاح")
+            if uow is None:
+                await batch.commit()
             return True
         except Exception as e:
             st.error(f"حدث خطأ في تحديث المستخدم: {str(e)}")
             return False
 
-    async def add_user(self, username, password, role, region_id=None):
-        """إضافة مستخدم جديد إلى قاعدة البيانات"""
+    async def add_user(self, username, password, role, region_id=None, uow=None):
+        """إضافة مستخدم جديد إلى قاعدة البيانات وإرجاع معرفه.
+        داخل وحدة عمل ترجع مرجعاً للمعرف يمكن تمريره لباقي الدوال في نفس الدفعة"""
         from auth import hash_password
         
         try:
@@ -441,17 +739,152 @@ class Database:
                 return False
             
             # إضافة المستخدم الجديد
-            await self.d1.execute(
-                "INSERT INTO Users (username, password_hash, role, assigned_region) VALUES (?, ?, ?, ?)",
+            batch = uow or self.unit_of_work()
+            index = batch.add(
+                """INSERT INTO Users (username, password_hash, role, assigned_region) VALUES (?, ?, ?, ?)
+                   RETURNING user_id""",
                 (username, hash_password(password), role, region_id)
             )
             
-            st.success("تمت إضافة المستخدم بنجاح")
-            return True
+            if uow is not None:
+                return SqlRef("SELECT user_id FROM Users WHERE username = ?", (username,))
+            
+            await batch.commit()
+            return batch.results[index][0][0]
         except Exception as e:
             st.error(f"حدث خطأ في إضافة المستخدم: {str(e)}")
             return False
 
+    def _user_filter_conditions(self, filters):
+        """بناء شروط البحث في دليل المستخدمين ومعاملاتها"""
+        filters = filters or {}
+        conditions = []
+        params = []
+
+        if filters.get('username'):
+            # بحث بالبادئة كنطاق حتى يستخدم فهرس اسم المستخدم
+            conditions.append("u.username >= ? AND u.username < ?")
+            params.extend([filters['username'], filters['username'] + '\uffff'])
+        if filters.get('role'):
+            conditions.append("u.role = ?")
+            params.append(filters['role'])
+        if filters.get('governorate_id') is not None:
+            conditions.append("""(h.governorate_id = ? OR (h.governorate_id IS NULL AND EXISTS (
+                SELECT 1 FROM GovernorateAdmins ga
+                WHERE ga.user_id = u.user_id AND ga.governorate_id = ?)))""")
+            params.extend([filters['governorate_id'], filters['governorate_id']])
+        if filters.get('admin_id') is not None:
+            conditions.append("u.assigned_region = ?")
+            params.append(filters['admin_id'])
+
+        return conditions, params
+
+    # صف واحد لكل مستخدم: مسؤول أكثر من محافظة يظهر بأول محافظاته ويطابق البحث بأي منها
+    _USER_DIRECTORY_JOINS = """
+        FROM Users u
+        LEFT JOIN HealthAdministrations h ON u.assigned_region = h.admin_id
+        LEFT JOIN Governorates g ON g.governorate_id = COALESCE(h.governorate_id, (
+            SELECT MIN(ga.governorate_id) FROM GovernorateAdmins ga WHERE ga.user_id = u.user_id))
+    """
+
+    async def count_users(self, filters=None):
+        """حساب عدد المستخدمين المطابقين للبحث"""
+        try:
+            conditions, params = self._user_filter_conditions(filters)
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            result = await self.d1.fetch_one(
+                f"SELECT COUNT(*) {self._USER_DIRECTORY_JOINS}{where}", params)
+            return result[0] if result else 0
+        except Exception as e:
+            st.error(f"حدث خطأ في حساب عدد المستخدمين: {str(e)}")
+            return 0
+
+    async def search_users(self, filters=None, page_size=50, after_username=None):
+        """جلب صفحة من دليل المستخدمين مرتبة حسب اسم المستخدم (ترقيم بالمفتاح)"""
+        try:
+            conditions, params = self._user_filter_conditions(filters)
+            if after_username is not None:
+                conditions.append("u.username > ?")
+                params.append(after_username)
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            params.append(page_size)
+
+            return await self.d1.fetch_all(
+                f"""SELECT u.user_id, u.username, u.role, g.governorate_name, h.admin_name
+                    {self._USER_DIRECTORY_JOINS}{where}
+                    ORDER BY u.username
+                    LIMIT ?""", params)
+        except Exception as e:
+            st.error(f"حدث خطأ في البحث عن المستخدمين: {str(e)}")
+            return []
+
+    async def get_existing_usernames(self, usernames):
+        """الحصول على أسماء المستخدمين الموجودة بالفعل من قائمة أسماء.
+        ترفع الخطأ حتى لا يُعامل كل اسم كجديد عند تعذر التحقق"""
+        existing = set()
+        for chunk in chunked(list(set(usernames)), D1_MAX_PARAMS):
+            rows = await self.d1.fetch_all(
+                f"SELECT username FROM Users WHERE username IN ({', '.join('?' * len(chunk))})",
+                chunk)
+            existing.update(r[0] for r in rows)
+        return existing
+
+    async def bulk_add_users(self, users):
+        """إضافة مجموعة مستخدمين على دفعات وإرجاع معرفاتهم حسب اسم المستخدم"""
+        from auth import hash_password
+
+        user_ids = {}
+        for chunk in chunked(users, D1_MAX_PARAMS // 4):
+            params = []
+            for username, password, role, region_id in chunk:
+                params.extend([username, hash_password(password), role, region_id])
+            rows = await self.d1.fetch_all(
+                f"""INSERT INTO Users (username, password_hash, role, assigned_region)
+                    VALUES {', '.join(['(?, ?, ?, ?)'] * len(chunk))}
+                    RETURNING user_id, username""", params)
+            user_ids.update({r[1]: r[0] for r in rows})
+        return user_ids
+
+    async def bulk_add_user_surveys(self, pairs):
+        """إضافة صلاحيات استبيانات (مستخدم، استبيان) على دفعات مع تجاهل المكرر"""
+        for chunk in chunked(pairs, D1_MAX_PARAMS // 2):
+            await self.d1.execute(
+                f"""INSERT OR IGNORE INTO UserSurveys (user_id, survey_id)
+                    VALUES {', '.join(['(?, ?)'] * len(chunk))}""",
+                [value for pair in chunk for value in pair])
+
+    async def bulk_add_governorate_admins(self, pairs):
+        """إضافة مسؤولي محافظات (مستخدم، محافظة) على دفعات مع تجاهل المكرر"""
+        for chunk in chunked(pairs, D1_MAX_PARAMS // 2):
+            await self.d1.execute(
+                f"""INSERT OR IGNORE INTO GovernorateAdmins (user_id, governorate_id)
+                    VALUES {', '.join(['(?, ?)'] * len(chunk))}""",
+                [value for pair in chunk for value in pair])
+
+    async def get_health_admins_with_governorates(self):
+        """استرجاع جميع الإدارات الصحية مع المحافظات التابعة لها"""
+        try:
+            return await shared_cache.get_or_load(
+                'health_admins_with_governorates', ('HealthAdministrations', 'Governorates'),
+                lambda: self.d1.fetch_all(
+                    """SELECT h.admin_id, h.admin_name, g.governorate_id, g.governorate_name
+                       FROM HealthAdministrations h
+                       JOIN Governorates g ON h.governorate_id = g.governorate_id"""
+                ))
+        except Exception as e:
+            st.error(f"حدث خطأ في جلب الإدارات الصحية: {str(e)}")
+            return []
+
+    async def get_survey_governorates(self):
+        """استرجاع جميع روابط الاستبيانات بالمحافظات"""
+        try:
+            return await shared_cache.get_or_load('survey_governorates', ('SurveyGovernorate',), lambda: self.d1.fetch_all(
+                "SELECT survey_id, governorate_id FROM SurveyGovernorate"
+            ))
+        except Exception as e:
+            st.error(f"حدث خطأ في جلب محافظات الاستبيانات: {str(e)}")
+            return []
+
     async def get_governorate_admin(self, user_id):
         """الحصول على بيانات مسؤول المحافظة"""
         return await self.d1.fetch_all(
@@ -461,13 +894,17 @@ class Database:
                WHERE ga.user_id = ?""", (user_id,)
         )
 
-    async def add_governorate_admin(self, user_id, governorate_id):
-        """إضافة مسؤول محافظة جديد"""
+    async def add_governorate_admin(self, user_id, governorate_id, uow=None):
+        """إضافة مسؤول محافظة جديد، ضمن وحدة عمل إذا مُررت"""
         try:
-            await self.d1.execute(
-                "INSERT INTO GovernorateAdmins (user_id, governorate_id) VALUES (?, ?)",
-                (user_id, governorate_id)
+            batch = uow or self.unit_of_work()
+            user_sql, user_params = bind(user_id)
+            batch.add(
+                f"INSERT INTO GovernorateAdmins (user_id, governorate_id) VALUES ({user_sql}, ?)",
+                user_params + [governorate_id]
             )
+            if uow is None:
+                await batch.commit()
             return True
         except Exception as e:
             st.error(f"خطأ في إضافة مسؤول المحافظة: {str(e)}")
@@ -476,24 +913,65 @@ class Database:
     async def get_governorate_admin_data(self, user_id):
         """الحصول على بيانات مسؤول المحافظة"""
         try:
-            return await self.d1.fetch_one(
-                """SELECT g.governorate_id, g.governorate_name, g.description 
-                   FROM GovernorateAdmins ga
-                   JOIN Governorates g ON ga.governorate_id = g.governorate_id
-                   WHERE ga.user_id = ?""", (user_id,))
+            return await shared_cache.get_or_load(
+                f'governorate_admin_data:{user_id}', ('GovernorateAdmins', 'Governorates'),
+                lambda: self.d1.fetch_one(
+                    """SELECT g.governorate_id, g.governorate_name, g.description 
+                       FROM GovernorateAdmins ga
+                       JOIN Governorates g ON ga.governorate_id = g.governorate_id
+                       WHERE ga.user_id = ?""", (user_id,)))
         except Exception as e:
             st.error(f"خطأ في جلب بيانات المحافظة: {str(e)}")
             return None
 
     async def get_governorate_surveys(self, governorate_id):
         """الحصول على الاستبيانات الخاصة بمحافظة معينة"""
-        return await self.d1.fetch_all(
+        return await shared_cache.get_or_load(
+            f'governorate_surveys:{governorate_id}', ('Surveys', 'SurveyGovernorate'), lambda: self.d1.fetch_all(
             """SELECT s.survey_id, s.survey_name, s.created_at, s.is_active
                FROM Surveys s
                JOIN SurveyGovernorate sg ON s.survey_id = sg.survey_id
                WHERE sg.governorate_id = ?
-               ORDER BY s.created_at DESC""", (governorate_id,))
+               ORDER BY s.created_at DESC""", (governorate_id,)
+        ))
     
+    # الموظفون الذين يملكون صلاحية الاستبيان في المحافظة ولم يكملوه في اليوم المحدد
+    _MISSING_SUBMISSIONS = """FROM HealthAdministrations ha
+               JOIN Users u ON u.assigned_region = ha.admin_id AND u.role = 'employee'
+               JOIN UserSurveys us ON us.user_id = u.user_id AND us.survey_id = ?
+               WHERE ha.governorate_id = ?"""
+    _SUBMITTED_ON_DAY = """EXISTS (SELECT 1 FROM Responses r
+                       WHERE r.user_id = u.user_id AND r.survey_id = us.survey_id
+                         AND r.is_completed = TRUE
+                         AND r.submission_date >= ? AND r.submission_date < DATE(?, '+1 day'))"""
+
+    async def get_submission_status_by_admin(self, survey_id, governorate_id, day):
+        """عدد الموظفين المكلفين بالاستبيان وعدد من لم يكمله في اليوم المحدد لكل إدارة صحية"""
+        try:
+            return await self.d1.fetch_all(
+                f"""SELECT ha.admin_id, ha.admin_name, COUNT(*),
+                           SUM(CASE WHEN {self._SUBMITTED_ON_DAY} THEN 0 ELSE 1 END)
+                    {self._MISSING_SUBMISSIONS}
+                    GROUP BY ha.admin_id, ha.admin_name
+                    ORDER BY ha.admin_name""",
+                (str(day), str(day), survey_id, governorate_id))
+        except Exception as e:
+            st.error(f"حدث خطأ في حساب حالة الإرسال: {str(e)}")
+            return []
+
+    async def get_missing_submissions(self, survey_id, governorate_id, day):
+        """الموظفون الذين لم يكملوا الاستبيان في اليوم المحدد مرتبين حسب الإدارة الصحية"""
+        try:
+            return await self.d1.fetch_all(
+                f"""SELECT ha.admin_id, ha.admin_name, u.user_id, u.username, u.last_login
+                    {self._MISSING_SUBMISSIONS}
+                      AND NOT {self._SUBMITTED_ON_DAY}
+                    ORDER BY ha.admin_name, u.username""",
+                (survey_id, governorate_id, str(day), str(day)))
+        except Exception as e:
+            st.error(f"حدث خطأ في جلب الموظفين الذين لم يرسلوا: {str(e)}")
+            return []
+
     async def get_governorate_employees(self, governorate_id):
         """الحصول على الموظفين التابعين لمحافظة معينة"""
         return await self.d1.fetch_all(
@@ -527,24 +1005,53 @@ class Database:
             st.error(f"حدث خطأ في جلب الاستبيانات المسموح بها: {str(e)}")
             return []
 
+    async def get_survey_info(self, survey_id):
+        """اسم الاستبيان وحالته وتاريخ إنشائه: (survey_name, is_active, created_at)"""
+        try:
+            return await request_loader('surveys_info', self.get_surveys_info, D1_MAX_PARAMS).load(survey_id)
+        except Exception as e:
+            st.error(f"حدث خطأ في جلب بيانات الاستبيان: {str(e)}")
+            return None
+
+    async def get_surveys_info(self, survey_ids):
+        """بيانات عدة استبيانات باستعلام واحد لما ليس في الذاكرة المشتركة، مفهرسة بمعرف الاستبيان"""
+        async def load(missing):
+            rows = await self.d1.fetch_all(
+                f"""SELECT survey_id, survey_name, is_active, created_at FROM Surveys
+                    WHERE survey_id IN ({', '.join('?' * len(missing))})""",
+                missing)
+            return {row[0]: tuple(row[1:]) for row in rows}
+        return await shared_cache.get_or_load_many('survey_info', survey_ids, ('Surveys',), load)
+
     async def get_survey_fields(self, survey_id):
         """الحصول على حقول استبيان معين"""
         try:
-            return await self.d1.fetch_all(
-                """SELECT 
-                       field_id, 
-                       field_label, 
-                       field_type, 
-                       field_options, 
-                       is_required, 
-                       field_order
-                   FROM Survey_Fields
-                   WHERE survey_id = ?
-                   ORDER BY field_order""", (survey_id,))
+            return await self.load_survey_fields(survey_id)
         except Exception as e:
             st.error(f"حدث خطأ في جلب حقول الاستبيان: {str(e)}")
             return []
 
+    async def load_survey_fields(self, survey_id):
+        """نفس get_survey_fields لكن ترفع الخطأ بدلاً من إرجاع قائمة فارغة، لمهام الخلفية"""
+        return (await self._load_surveys_fields([survey_id]))[survey_id]
+
+    async def _load_surveys_fields(self, survey_ids):
+        """حقول الاستبيانات من الذاكرة المشتركة أو من قاعدة البيانات: (field_id, field_label, field_type,
+        field_options, is_required, field_order, page_number)"""
+        async def load(missing):
+            fields = {survey_id: [] for survey_id in missing}
+            for chunk in chunked(missing, D1_MAX_PARAMS):
+                rows = await self.d1.fetch_all(
+                    f"""SELECT survey_id, field_id, field_label, field_type, field_options,
+                               is_required, field_order, page_number
+                        FROM Survey_Fields
+                        WHERE survey_id IN ({', '.join('?' * len(chunk))})
+                        ORDER BY survey_id, field_order""", chunk)
+                for row in rows:
+                    fields[row[0]].append(row[1:])
+            return fields
+        return await shared_cache.get_or_load_many('survey_fields', survey_ids, ('Survey_Fields',), load)
+
     async def get_user_allowed_surveys(self, user_id):
         """الحصول على الاستبيانات المسموح بها للمستخدم"""
         try:
@@ -558,46 +1065,90 @@ class Database:
             st.error(f"حدث خطأ في جلب الاستبيانات المسموح بها: {str(e)}")
             return []
 
-    async def update_user_allowed_surveys(self, user_id, survey_ids):
-        """تحديث الاستبيانات المسموح بها للمستخدم"""
+    async def update_user_allowed_surveys(self, user_id, survey_ids, uow=None):
+        """تحديث الاستبيانات المسموح بها للمستخدم مع الاحتفاظ فقط بالمسموح منها لمحافظته"""
         try:
-            # الحصول على محافظة المستخدم
-            governorate_id = await self.d1.fetch_one(
-                """SELECT ha.governorate_id 
-                   FROM Users u
-                   JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
-                   WHERE u.user_id = ?""", (user_id,))
-            
-            if not governorate_id:
-                st.error("المستخدم غير مرتبط بمحافظة")
-                return False
-            
-            # التحقق من أن الاستبيانات مسموحة للمحافظة
-            valid_surveys = []
-            for survey_id in survey_ids:
-                existing = await self.d1.fetch_one(
-                    """SELECT 1 FROM SurveyGovernorate 
-                       WHERE survey_id = ? AND governorate_id = ?""",
-                    (survey_id, governorate_id[0]))
-                
-                if existing:
-                    valid_surveys.append(survey_id)
+            batch = uow or self.unit_of_work()
+            user_sql, user_params = bind(user_id)
             
             # حذف جميع التصاريح الحالية
-            await self.d1.execute(
-                "DELETE FROM UserSurveys WHERE user_id=?", (user_id,))
+            batch.add(f"DELETE FROM UserSurveys WHERE user_id = {user_sql}", user_params)
             
-            # إضافة التصاريح الجديدة
-            for survey_id in valid_surveys:
-                await self.d1.execute(
-                    "INSERT INTO UserSurveys (user_id, survey_id) VALUES (?, ?)",
-                    (user_id, survey_id))
+            # إضافة التصاريح الجديدة المسموحة لمحافظة المستخدم (موظف أو مسؤول محافظة)
+            for chunk in chunked(survey_ids, D1_MAX_PARAMS - len(user_params)):
+                batch.add(
+                    f"""INSERT OR IGNORE INTO UserSurveys (user_id, survey_id)
+                        SELECT u.user_id, sg.survey_id
+                        FROM Users u
+                        LEFT JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
+                        LEFT JOIN GovernorateAdmins ga ON ga.user_id = u.user_id
+                        JOIN SurveyGovernorate sg
+                          ON sg.governorate_id = COALESCE(ha.governorate_id, ga.governorate_id)
+                        WHERE u.user_id = {user_sql}
+                          AND sg.survey_id IN ({', '.join('?' * len(chunk))})""",
+                    user_params + list(chunk)
+                )
             
+            if uow is None:
+                await batch.commit()
             return True
         except Exception as e:
             st.error(f"حدث خطأ في تحديث الاستبيانات المسموح بها: {str(e)}")
             return False
 
+    _EMPLOYEES_IN_SCOPE = """SELECT u.user_id
+               FROM Users u
+               JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
+               WHERE u.role = 'employee' AND ha.governorate_id = ?
+                 AND (? IS NULL OR ha.admin_id = ?)"""
+
+    async def assign_survey_to_employees(self, survey_id, governorate_id, admin_id=None):
+        """منح استبيان لجميع موظفي محافظة أو إدارة صحية باستعلام واحد وإرجاع عدد المضافين"""
+        try:
+            rows = await self.d1.fetch_all(
+                f"""INSERT INTO UserSurveys (user_id, survey_id)
+                    SELECT user_id, ? FROM ({self._EMPLOYEES_IN_SCOPE})
+                    WHERE EXISTS (SELECT 1 FROM SurveyGovernorate
+                                  WHERE survey_id = ? AND governorate_id = ?)
+                    ON CONFLICT(user_id, survey_id) DO NOTHING
+                    RETURNING user_id""",
+                (survey_id, governorate_id, admin_id, admin_id, survey_id, governorate_id))
+
+            await self.log_audit_action(
+                st.session_state.user_id,
+                'INSERT',
+                'UserSurveys',
+                survey_id,
+                None,
+                {'governorate_id': governorate_id, 'admin_id': admin_id, 'users': len(rows)}
+            )
+            return len(rows)
+        except Exception as e:
+            st.error(f"حدث خطأ في منح الاستبيان للموظفين: {str(e)}")
+            return None
+
+    async def revoke_survey_from_employees(self, survey_id, governorate_id, admin_id=None):
+        """سحب استبيان من جميع موظفي محافظة أو إدارة صحية باستعلام واحد وإرجاع عدد المحذوفين"""
+        try:
+            rows = await self.d1.fetch_all(
+                f"""DELETE FROM UserSurveys
+                    WHERE survey_id = ? AND user_id IN ({self._EMPLOYEES_IN_SCOPE})
+                    RETURNING user_id""",
+                (survey_id, governorate_id, admin_id, admin_id))
+
+            await self.log_audit_action(
+                st.session_state.user_id,
+                'DELETE',
+                'UserSurveys',
+                survey_id,
+                {'governorate_id': governorate_id, 'admin_id': admin_id, 'users': len(rows)},
+                None
+            )
+            return len(rows)
+        except Exception as e:
+            st.error(f"حدث خطأ في سحب الاستبيان من الموظفين: {str(e)}")
+            return None
+
     async def get_response_details(self, response_id):
         """الحصول على تفاصيل إجابة محددة"""
         try:
@@ -612,45 +1163,215 @@ class Database:
             st.error(f"حدث خطأ في جلب تفاصيل الإجابة: {str(e)}")
             return []
 
-    async def update_response_detail(self, detail_id, new_value):
-        """تحديث قيمة إجابة محددة"""
+    async def update_response_details(self, response_id, changes, expected_version):
+        """تحديث عدة إجابات دفعة واحدة بشرط عدم تعديلها من مستخدم آخر.
+        ترجع الإصدار الجديد عند النجاح، و0 إذا كانت البيانات قديمة، وNone عند حدوث خطأ"""
         try:
-            await self.d1.execute(
-                "UPDATE Response_Details SET answer_value = ? WHERE detail_id = ?",
-                (new_value, detail_id)
-            )
-            return True
+            items = list(changes.items())
+            # كل الخطوات مشروطة بأن الإصدار ما زال الإصدار الذي بدأ عنده التعديل وتُنفذ في معاملة واحدة،
+            # فالمحرر الذي يخسر السباق لا يكتب شيئاً، وفشل أي خطوة لا يرفع الإصدار
+            unchanged = "EXISTS (SELECT 1 FROM Responses WHERE response_id = ? AND row_version = ?)"
+            async with self.unit_of_work() as uow:
+                for chunk in chunked(items, (D1_MAX_PARAMS - 3) // 2):
+                    uow.add(
+                        f"""UPDATE Response_Details SET answer_value = v.column2
+                            FROM (VALUES {', '.join(['(?, ?)'] * len(chunk))}) AS v
+                            WHERE Response_Details.detail_id = v.column1
+                              AND Response_Details.response_id = ?
+                              AND {unchanged}""",
+                        [value for pair in chunk for value in pair] + [response_id, response_id, expected_version])
+
+                uow.add(
+                    f"""INSERT INTO AuditLog (user_id, action_type, table_name, record_id, old_value, new_value)
+                        SELECT ?, 'UPDATE', 'Response_Details', ?, ?, ?
+                        WHERE {unchanged}""",
+                    (st.session_state.user_id, response_id,
+                     json.dumps({'row_version': expected_version}),
+                     json.dumps({'row_version': expected_version + 1, 'changes': {str(k): v for k, v in items}}),
+                     response_id, expected_version))
+
+                # حجز الإصدار أخيراً: ينجح محرر واحد فقط لكل إصدار
+                claim = uow.add(
+                    """UPDATE Responses SET row_version = row_version + 1
+                       WHERE response_id = ? AND row_version = ?
+                       RETURNING row_version""",
+                    (response_id, expected_version))
+
+            claimed = uow.results[claim]
+            return claimed[0][0] if claimed else 0
         except Exception as e:
             st.error(f"حدث خطأ في تحديث الإجابة: {str(e)}")
-            return False
+            return None
 
     async def get_response_info(self, response_id):
         """الحصول على معلومات أساسية عن الإجابة"""
         try:
-            return await self.d1.fetch_one(
-                """SELECT r.response_id, s.survey_name, u.username, 
-                      ha.admin_name, g.governorate_name, r.submission_date
-                   FROM Responses r
-                   JOIN Surveys s ON r.survey_id = s.survey_id
-                   JOIN Users u ON r.user_id = u.user_id
-                   JOIN HealthAdministrations ha ON r.region_id = ha.admin_id
-                   JOIN Governorates g ON ha.governorate_id = g.governorate_id
-                   WHERE r.response_id = ?""", (response_id,))
+            return await request_loader(
+                'responses_info', self.get_responses_info, D1_MAX_PARAMS).load(response_id)
         except Exception as e:
             st.error(f"حدث خطأ في جلب معلومات الإجابة: {str(e)}")
             return None
 
+    async def get_responses_info(self, response_ids):
+        """معلومات عدة إجابات باستعلام واحد، مفهرسة بمعرف الإجابة"""
+        rows = await self.d1.fetch_all(
+            f"""SELECT r.response_id, s.survey_name, u.username, 
+                   ha.admin_name, g.governorate_name, r.submission_date,
+                   r.row_version
+                FROM Responses r
+                JOIN Surveys s ON r.survey_id = s.survey_id
+                JOIN Users u ON r.user_id = u.user_id
+                JOIN HealthAdministrations ha ON r.region_id = ha.admin_id
+                JOIN Governorates g ON ha.governorate_id = g.governorate_id
+                WHERE r.response_id IN ({', '.join('?' * len(response_ids))})""",
+            list(response_ids))
+        return {row[0]: row for row in rows}
+
+    async def get_survey_data_version(self, survey_id):
+        """الحصول على إصدار بيانات الاستبيان (أكبر معرف إجابة، عدد الإجابات، عدادات التغيير بما فيها الحقول)"""
+        try:
+            result = await self.d1.fetch_one(
+                """SELECT COALESCE(MAX(r.response_id), 0), COUNT(*),
+                          COALESCE((SELECT responses_version FROM SurveyDataVersions WHERE survey_id = ?), 0),
+                          COALESCE((SELECT details_version FROM SurveyDataVersions WHERE survey_id = ?), 0),
+                          COALESCE((SELECT fields_version FROM SurveyDataVersions WHERE survey_id = ?), 0)
+                   FROM Responses r
+                   WHERE r.survey_id = ?""", (survey_id, survey_id, survey_id, survey_id))
+            return tuple(result) if result else (0, 0, 0, 0, 0)
+        except Exception as e:
+            st.error(f"حدث خطأ في جلب إصدار بيانات الاستبيان: {str(e)}")
+            return None
+
+    async def load_survey_responses(self, survey_id, governorate_id=None):
+        """الحصول على إجابات استبيان لمهام الخلفية؛ ترفع الخطأ بدلاً من إرجاع قائمة فارغة"""
+        query = """
+            SELECT r.response_id, u.username, h.admin_name, g.governorate_name,
+                   r.submission_date, r.is_completed
+            FROM Responses r
+            JOIN Users u ON r.user_id = u.user_id
+            JOIN HealthAdministrations h ON r.region_id = h.admin_id
+            JOIN Governorates g ON h.governorate_id = g.governorate_id
+            WHERE r.survey_id = ?
+        """
+        params = [survey_id]
+
+        if governorate_id is not None:
+            query += " AND h.governorate_id = ?"
+            params.append(governorate_id)
+
+        query += " ORDER BY r.submission_date DESC"
+
+        return await self.d1.fetch_all(query, params)
+
+    def _response_filter_conditions(self, survey_id, filters):
+        """بناء شروط تصفية الإجابات ومعاملاتها"""
+        filters = filters or {}
+        conditions = ["r.survey_id = ?"]
+        params = [survey_id]
+
+        if filters.get('governorate_id') is not None:
+            conditions.append("h.governorate_id = ?")
+            params.append(filters['governorate_id'])
+        if filters.get('admin_id') is not None:
+            conditions.append("r.region_id = ?")
+            params.append(filters['admin_id'])
+        if filters.get('username'):
+            conditions.append("u.username LIKE ? ESCAPE '\\'")
+            prefix = filters['username'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(prefix + '%')
+        if filters.get('date_from'):
+            conditions.append("r.submission_date >= ?")
+            params.append(str(filters['date_from']))
+        if filters.get('date_to'):
+            conditions.append("r.submission_date < DATE(?, '+1 day')")
+            params.append(str(filters['date_to']))
+        if filters.get('is_completed') is not None:
+            conditions.append("r.is_completed = ?")
+            params.append(bool(filters['is_completed']))
+
+        return conditions, params
+
+    async def count_survey_responses(self, survey_id, filters=None):
+        """حساب عدد الإجابات المطابقة للتصفية وعدد المكتملة منها وعدد المناطق"""
+        try:
+            conditions, params = self._response_filter_conditions(survey_id, filters)
+            result = await self.d1.fetch_one(
+                f"""SELECT COUNT(*),
+                           COALESCE(SUM(CASE WHEN r.is_completed THEN 1 ELSE 0 END), 0),
+                           COUNT(DISTINCT r.region_id)
+                    FROM Responses r
+                    JOIN Users u ON r.user_id = u.user_id
+                    JOIN HealthAdministrations h ON r.region_id = h.admin_id
+                    WHERE {' AND '.join(conditions)}""", params)
+            return tuple(result) if result else (0, 0, 0)
+        except Exception as e:
+            st.error(f"حدث خطأ في حساب عدد الإجابات: {str(e)}")
+            return (0, 0, 0)
+
+    async def get_survey_responses_page(self, survey_id, filters=None, page_size=50, cursor=None):
+        """جلب صفحة واحدة من الإجابات المطابقة للتصفية مرتبة من الأحدث (ترقيم بالمفتاح)"""
+        try:
+            conditions, params = self._response_filter_conditions(survey_id, filters)
+
+            # المؤشر هو (تاريخ التقديم، معرف الإجابة) لآخر صف في الصفحة السابقة
+            if cursor:
+                conditions.append(
+                    "(r.submission_date < ? OR (r.submission_date = ? AND r.response_id < ?))")
+                params.extend([cursor[0], cursor[0], cursor[1]])
+
+            params.append(page_size)
+            return await self.d1.fetch_all(
+                f"""SELECT r.response_id, u.username, h.admin_name, g.governorate_name,
+                           r.submission_date, r.is_completed
+                    FROM Responses r
+                    JOIN Users u ON r.user_id = u.user_id
+                    JOIN HealthAdministrations h ON r.region_id = h.admin_id
+                    JOIN Governorates g ON h.governorate_id = g.governorate_id
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY r.submission_date DESC, r.response_id DESC
+                    LIMIT ?""", params)
+        except Exception as e:
+            st.error(f"حدث خطأ في جلب صفحة الإجابات: {str(e)}")
+            return []
+
+    async def iter_survey_response_details(self, survey_id, governorate_id=None, page_size=5000):
+        """جلب تفاصيل جميع إجابات الاستبيان على دفعات باستخدام ترقيم الصفحات"""
+        query = """
+            SELECT rd.detail_id, rd.response_id, sf.field_label, rd.answer_value,
+                   u.username, r.submission_date, r.is_completed, rd.field_id
+            FROM Response_Details rd
+            JOIN Responses r ON rd.response_id = r.response_id
+            JOIN Survey_Fields sf ON rd.field_id = sf.field_id
+            JOIN Users u ON r.user_id = u.user_id
+        """
+        if governorate_id is not None:
+            query += " JOIN HealthAdministrations h ON r.region_id = h.admin_id"
+        query += " WHERE r.survey_id = ? AND rd.detail_id > ?"
+        if governorate_id is not None:
+            query += " AND h.governorate_id = ?"
+        query += " ORDER BY rd.detail_id LIMIT ?"
+
+        last_detail_id = 0
+        while True:
+            params = [survey_id, last_detail_id]
+            if governorate_id is not None:
+                params.append(governorate_id)
+            params.append(page_size)
+
+            rows = await self.d1.fetch_all(query, params)
+            if not rows:
+                break
+
+            yield rows
+
+            if len(rows) < page_size:
+                break
+            last_detail_id = rows[-1][0]
+
     async def log_audit_action(self, user_id, action_type, table_name, record_id=None, old_value=None, new_value=None):
-        """تسجيل إجراء في سجل التعديلات"""
+        """تسجيل إجراء في سجل التعديلات (يُكتب مؤجلاً على دفعات)"""
         try:
-            await self.d1.execute(
-                """INSERT INTO AuditLog 
-                   (user_id, action_type, table_name, record_id, old_value, new_value)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (user_id, action_type, table_name, record_id, 
-                 json.dumps(old_value) if old_value else None,
-                 json.dumps(new_value) if new_value else None)
-            )
+            write_behind.add_audit(user_id, action_type, table_name, record_id, old_value, new_value)
             return True
         except Exception as e:
             st.error(f"حدث خطأ في تسجيل الإجراء: {str(e)}")
@@ -659,6 +1380,8 @@ class Database:
     async def get_audit_logs(self, table_name=None, action_type=None, username=None, date_range=None, search_query=None):
         """الحصول على سجل التعديلات مع فلاتر متقدمة"""
         try:
+            # كتابة السجلات المؤجلة أولاً حتى تظهر أحدث الإجراءات
+            await write_behind.flush()
             query = """
                 SELECT a.log_id, u.username, a.action_type, a.table_name, 
                        a.record_id, a.old_value, a.new_value, a.action_timestamp
@@ -703,6 +1426,78 @@ class Database:
             st.error(f"حدث خطأ في جلب سجل التعديلات: {str(e)}")
             return []
 
+    async def get_employee_home(self, user_id, region_id):
+        """كل ما تحتاجه صفحة الموظف في طلب واحد: المنطقة وآخر دخول والاستبيانات المسموح بها
+        مع حالة إكمالها اليوم وحقولها"""
+        try:
+            region, last_login, surveys, fields = await self.d1.batch([
+                ("""SELECT h.admin_id, h.admin_name, g.governorate_name, g.governorate_id
+                    FROM HealthAdministrations h
+                    JOIN Governorates g ON h.governorate_id = g.governorate_id
+                    WHERE h.admin_id = ?""", (region_id,)),
+                ("SELECT last_login FROM Users WHERE user_id = ?", (user_id,)),
+                ("""SELECT s.survey_id, s.survey_name, s.created_at,
+                           EXISTS (SELECT 1 FROM Responses r
+                                   WHERE r.user_id = us.user_id AND r.survey_id = s.survey_id
+                                     AND r.is_completed = TRUE
+                                     AND DATE(r.submission_date) = DATE('now'))
+                    FROM UserSurveys us
+                    JOIN Surveys s ON s.survey_id = us.survey_id
+                    WHERE us.user_id = ?
+                    ORDER BY s.survey_name""", (user_id,)),
+                ("""SELECT sf.survey_id, sf.field_id, sf.field_label, sf.field_type, sf.field_options,
+                           sf.is_required, sf.field_order, sf.page_number
+                    FROM UserSurveys us
+                    JOIN Survey_Fields sf ON sf.survey_id = us.survey_id
+                    WHERE us.user_id = ?
+                    ORDER BY sf.survey_id, sf.field_order""", (user_id,))
+            ])
+
+            home_surveys = {
+                row[0]: {
+                    'survey_name': row[1],
+                    'created_at': row[2],
+                    'completed_today': bool(row[3]),
+                    'fields': []
+                } for row in surveys
+            }
+            for row in fields:
+                home_surveys[row[0]]['fields'].append(row[1:])
+
+            return {
+                'region_info': {
+                    'admin_id': region[0][0],
+                    'admin_name': region[0][1],
+                    'governorate_name': region[0][2],
+                    'governorate_id': region[0][3]
+                } if region else None,
+                'last_login': last_login[0][0] if last_login else None,
+                'surveys': home_surveys
+            }
+        except Exception as e:
+            st.error(f"حدث خطأ في جلب بيانات صفحة الموظف: {str(e)}")
+            return None
+
+    async def get_surveys_completed_today(self, user_id, survey_ids):
+        """الاستبيانات التي أكملها المستخدم اليوم من بين قائمة استبيانات في طلب واحد،
+        أو None عند الخطأ حتى لا يُقبل الإرسال دون تحقق"""
+        try:
+            completed = set()
+            async with self.unit_of_work() as uow:
+                queries = [uow.add(
+                    f"""SELECT v.column1 FROM (VALUES {', '.join(['(?)'] * len(chunk))}) AS v
+                        WHERE EXISTS (SELECT 1 FROM Responses r
+                                      WHERE r.user_id = ? AND r.survey_id = v.column1
+                                        AND r.is_completed = TRUE
+                                        AND DATE(r.submission_date) = DATE('now'))""",
+                    list(chunk) + [user_id]) for chunk in chunked(survey_ids, D1_MAX_PARAMS - 1)]
+            for query in queries:
+                completed.update(row[0] for row in uow.results[query])
+            return completed
+        except Exception as e:
+            st.error(f"حدث خطأ في التحقق من إكمال الاستبيانات: {str(e)}")
+            return None
+
     async def has_completed_survey_today(self, user_id, survey_id):
         """التحقق مما إذا كان المستخدم قد أكمل الاستبيان اليوم"""
         try:
@@ -715,11 +1510,5 @@ class Database:
         except Exception as e:
             st.error(f"حدث خطأ في التحقق من إكمال الاستبيان: {str(e)}")
             return False
-    async def get_user_role(self, user_id):
-        """الحصول على دور المستخدم"""
-        role = await self.d1.fetch_one(
-            "SELECT role FROM Users WHERE user_id=?", (user_id,)
-        )
-        return role[0] if role else None
 # إنشاء نسخة واحدة من قاعدة البيانات لتستخدمها التطبيق
 db = Database()
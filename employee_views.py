@@ -1,54 +1,68 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+import json
+from datetime import datetime, date, timezone
 from database import db
+from outbox import submission_outbox
+
+# بيانات الصفحة الرئيسية للموظف المحفوظة في الجلسة حتى الإرسال التالي أو اليوم التالي
+EMPLOYEE_HOME_KEY = "employee_home"
 
 async def show_employee_dashboard():
     if not st.session_state.get('region_id'):
         st.error("حسابك غير مرتبط بأي منطقة. يرجى التواصل مع المسؤول.")
         return
 
-    region_info = await get_employee_region_info(st.session_state.region_id)
+    if st.sidebar.button("🔄 تحديث الاستبيانات"):
+        refresh_employee_home()
+
+    home = await load_employee_home(st.session_state.user_id, st.session_state.region_id)
+    if home is None:
+        return
+    region_info = home['region_info']
     if not region_info:
         st.error("لم يتم العثور على معلومات المنطقة الخاصة بك في النظام")
         return
 
-    await display_employee_header(region_info)
-    allowed_surveys = await get_allowed_surveys(st.session_state.user_id)
+    await display_employee_header(region_info, home['last_login'])
+    surveys = home['surveys']
     
-    if not allowed_surveys:
+    if not surveys:
         st.info("لا توجد استبيانات متاحة لك حاليًا")
         return
 
-    selected_surveys = await display_survey_selection(allowed_surveys)
+    selected_surveys = await display_survey_selection(
+        [(survey_id, survey['survey_name']) for survey_id, survey in surveys.items()]
+    )
+    submitted_today = get_submitted_today(st.session_state.user_id, surveys)
+    
+    if len(selected_surveys) > 1 and st.toggle("إرسال جميع الاستبيانات المحددة مرة واحدة", key="combined_submission"):
+        await display_combined_form(selected_surveys, surveys, submitted_today, region_info['admin_id'])
+        return
     
     for survey_id in selected_surveys:
-        await display_single_survey(survey_id, region_info['admin_id'])
+        await display_single_survey(survey_id, surveys[survey_id], submitted_today, region_info['admin_id'])
 
-async def get_employee_region_info(region_id):
-    try:
-        result = await db.d1.fetch_one('''
-            SELECT h.admin_id, h.admin_name, g.governorate_name, g.governorate_id
-            FROM HealthAdministrations h
-            JOIN Governorates g ON h.governorate_id = g.governorate_id
-            WHERE h.admin_id = ?
-        ''', (region_id,))
-        return {
-            'admin_id': result[0],
-            'admin_name': result[1],
-            'governorate_name': result[2],
-            'governorate_id': result[3]
-        } if result else None
-    except Exception as e:
-        st.error(f"خطأ في قاعدة البيانات: {str(e)}")
-        return None
+async def load_employee_home(user_id, region_id):
+    """بيانات الصفحة الرئيسية من الجلسة، أو من قاعدة البيانات في طلب واحد عند أول عرض أو بداية يوم جديد"""
+    today = datetime.now(timezone.utc).date()
+    cached = st.session_state.get(EMPLOYEE_HOME_KEY)
+    if cached and cached['day'] == today:
+        return cached['home']
+
+    home = await db.get_employee_home(user_id, region_id)
+    if home is not None:
+        st.session_state[EMPLOYEE_HOME_KEY] = {'day': today, 'home': home}
+    return home
 
-async def display_employee_header(region_info):
+def refresh_employee_home():
+    """إعادة تحميل بيانات الصفحة الرئيسية في العرض التالي"""
+    st.session_state.pop(EMPLOYEE_HOME_KEY, None)
+
+async def display_employee_header(region_info, last_login):
     st.set_page_config(layout="wide")
     st.title(f"لوحة الموظف - {region_info['admin_name']}")
     
-    last_login = await get_last_login(st.session_state.user_id)
-    
     col1, col2, col3 = st.columns(3)
     with col1:
         st.subheader("المحافظة")
@@ -60,14 +74,6 @@ async def display_employee_header(region_info):
         st.subheader("آخر دخول")
         st.info(last_login if last_login else "غير معروف")
 
-async def get_last_login(user_id):
-    try:
-        result = await db.d1.fetch_one("SELECT last_login FROM Users WHERE user_id=?", (user_id,))
-        return result[0] if result and result[0] else None
-    except Exception as e:
-        st.error(f"حدث خطأ في جلب وقت آخر دخول: {str(e)}")
-        return None
-
 async def display_survey_selection(allowed_surveys):
     st.header("الاستبيانات المتاحة")
     
@@ -80,62 +86,215 @@ async def display_survey_selection(allowed_surveys):
     
     return selected_surveys
 
-async def display_single_survey(survey_id, region_id):
-    survey_info = await db.d1.fetch_one('''
-        SELECT survey_name, created_at FROM Surveys WHERE survey_id = ?
-    ''', (survey_id,))
+async def display_single_survey(survey_id, survey, submitted_today, region_id):
+    if survey_id in submitted_today:
+        st.warning(f"لقد أكملت استبيان '{survey['survey_name']}' اليوم. يمكنك إكماله مرة أخرى غدًا.")
+        return
+        
+    with st.expander(f"📋 {survey['survey_name']} (تاريخ الإنشاء: {survey['created_at']})"):
+        await display_survey_form(survey_id, region_id, survey['fields'], survey['survey_name'])
+
+async def display_combined_form(survey_ids, surveys, submitted_today, region_id):
+    user_id = st.session_state.user_id
+    survey_names = {survey_id: surveys[survey_id]['survey_name'] for survey_id in survey_ids}
+    for survey_id in survey_ids:
+        if survey_id in submitted_today:
+            st.warning(f"لقد أكملت استبيان '{survey_names[survey_id]}' اليوم. يمكنك إكماله مرة أخرى غدًا.")
     
-    if not survey_info:
-        st.error("الاستبيان المحدد غير موجود")
+    survey_ids = [sid for sid in survey_ids if sid not in submitted_today]
+    if not survey_ids:
         return
+    
+    fields_by_survey = {survey_id: surveys[survey_id]['fields'] for survey_id in survey_ids}
+    
+    # المسودات تُحمل كما في النموذج المنفرد حتى تُستكمل عند الإرسال بدلاً من بقائها معلقة
+    drafts_loaded = [survey_names[survey_id] for survey_id in survey_ids
+                     if await load_survey_draft(survey_id, fields_by_survey[survey_id])]
+    if drafts_loaded:
+        st.info(f"تم تحميل المسودات المحفوظة للاستبيانات: {'، '.join(drafts_loaded)}")
+    
+    with st.form("combined_survey_form"):
+        st.markdown("**يرجى تعبئة جميع الحقول المطلوبة (*)**")
+        answers_by_survey = {}
+        for survey_id in survey_ids:
+            st.subheader(f"📋 {survey_names[survey_id]}")
+            saved_answers = st.session_state.get(f"survey_answers_{survey_id}", {})
+            fields = fields_by_survey[survey_id]
+            pages = sorted({field[6] or 1 for field in fields})
+            answers_by_survey[survey_id] = {}
+            # صفحات الاستبيان تُعرض متتالية تحت عناوين فرعية بنفس ترتيبها في النموذج المنفرد
+            for page in pages:
+                if len(pages) > 1:
+                    st.markdown(f"**الصفحة {pages.index(page) + 1} من {len(pages)}**")
+                for field_id, label, field_type, options, is_required, *_ in (
+                        field for field in fields if (field[6] or 1) == page):
+                    answers_by_survey[survey_id][field_id] = render_field(
+                        field_id, label, field_type, options, is_required, saved_answers.get(field_id))
         
-    if await db.has_completed_survey_today(st.session_state.user_id, survey_id):
-        st.warning(f"لقد أكملت استبيان '{survey_info[0]}' اليوم. يمكنك إكماله مرة أخرى غدًا.")
+        submitted = st.form_submit_button(f"🚀 إرسال {len(survey_ids)} استبيانات")
+    
+    if not submitted:
         return
+    
+    # التحقق من جميع الاستبيانات ثم حفظ الصالح منها في صندوق الإرسال دفعة واحدة
+    submissions = []
+    for survey_id in survey_ids:
+        missing_fields = check_required_fields(fields_by_survey[survey_id], answers_by_survey[survey_id])
+        if missing_fields:
+            st.error(f"{survey_names[survey_id]}: الحقول التالية مطلوبة: {', '.join(missing_fields)}")
+            continue
         
-    with st.expander(f"📋 {survey_info[0]} (تاريخ الإنشاء: {survey_info[1]})"):
-        fields = await db.get_survey_fields(survey_id)
-        await display_survey_form(survey_id, region_id, fields, survey_info[0])
+        draft = st.session_state.get(f"survey_draft_{survey_id}") or {}
+        submissions.append({
+            'user_id': user_id,
+            'survey_id': survey_id,
+            'region_id': region_id,
+            'answers': {field_id: str(answer)
+                        for field_id, answer in answers_by_survey[survey_id].items() if answer is not None},
+            'response_id': draft.get('response_id')
+        })
+    
+    if not submissions:
+        return
+    
+    # بيانات الصفحة الرئيسية قد تكون أقدم من إكمال تم من جلسة أخرى، فيُعاد التحقق من قاعدة البيانات
+    survey_ids = [submission['survey_id'] for submission in submissions]
+    already_submitted = submission_outbox.pending_today(user_id, survey_ids)
+    completed = await db.get_surveys_completed_today(
+        user_id, [survey_id for survey_id in survey_ids if survey_id not in already_submitted])
+    if completed is None:
+        return
+    already_submitted |= completed
+    if already_submitted:
+        refresh_employee_home()
+        for survey_id in already_submitted:
+            st.error(f"لقد قمت بإكمال استبيان '{survey_names[survey_id]}' اليوم بالفعل. يمكنك إكماله مرة أخرى غدًا.")
+        submissions = [submission for submission in submissions if submission['survey_id'] not in already_submitted]
+        if not submissions:
+            return
+    
+    try:
+        submission_outbox.enqueue_many(submissions)
+    except Exception as e:
+        st.error(f"حدث خطأ أثناء حفظ البيانات: {str(e)}")
+        return
+    
+    refresh_employee_home()
+    for submission in submissions:
+        survey_id = submission['survey_id']
+        for key in (f"survey_draft_{survey_id}", f"survey_answers_{survey_id}", f"survey_page_{survey_id}"):
+            st.session_state.pop(key, None)
+        st.success(f"تم إرسال استبيان '{survey_names[survey_id]}' بنجاح")
+
+async def load_survey_draft(survey_id, fields):
+    """تحميل المسودة المحفوظة سابقًا وإجاباتها إلى الجلسة مرة واحدة، وإرجاع True إذا وُجدت مسودة"""
+    draft_key = f"survey_draft_{survey_id}"
+    if draft_key in st.session_state:
+        return False
+    draft = await db.get_user_draft(st.session_state.user_id, survey_id)
+    response_id, draft_answers = draft if draft else (None, {})
+    st.session_state[draft_key] = {'response_id': response_id, 'saved': draft_answers}
+    field_types = {field[0]: field[2] for field in fields}
+    st.session_state[f"survey_answers_{survey_id}"] = {
+        field_id: parse_answer(field_types[field_id], value)
+        for field_id, value in draft_answers.items() if field_id in field_types
+    }
+    return bool(draft)
 
 async def display_survey_form(survey_id, region_id, fields, survey_name):
+    pages = sorted({field[6] or 1 for field in fields})
+    page_key = f"survey_page_{survey_id}"
+    answers_key = f"survey_answers_{survey_id}"
+
+    if st.session_state.get(page_key) not in pages:
+        st.session_state[page_key] = pages[0] if pages else 1
+
+    draft_key = f"survey_draft_{survey_id}"
+    if await load_survey_draft(survey_id, fields):
+        st.info("تم تحميل المسودة المحفوظة لهذا الاستبيان")
+    saved_answers = st.session_state.setdefault(answers_key, {})
+
+    current_page = st.session_state[page_key]
+    page_index = pages.index(current_page) if pages else 0
+    is_last_page = page_index == len(pages) - 1
+    page_fields = [field for field in fields if (field[6] or 1) == current_page]
+
     with st.form(f"survey_form_{survey_id}"):
         st.markdown("**يرجى تعبئة جميع الحقول المطلوبة (*)**")
         st.subheader("🧾 بيانات الاستبيان")
-        answers = {}
-        for field in fields:
-            field_id, label, field_type, options, is_required, _ = field
-            answers[field_id] = render_field(field_id, label, field_type, options, is_required)
+        if len(pages) > 1:
+            st.progress((page_index + 1) / len(pages), text=f"الصفحة {page_index + 1} من {len(pages)}")
+
+        page_answers = {}
+        for field in page_fields:
+            field_id, label, field_type, options, is_required, *_ = field
+            page_answers[field_id] = render_field(field_id, label, field_type, options, is_required,
+                                                  saved_answers.get(field_id))
         
-        col1, col2 = st.columns(2)
+        col1, col2, col3, col4 = st.columns(4)
         with col1:
-            submitted = st.form_submit_button("🚀 إرسال النموذج")
+            previous_page = st.form_submit_button("⬅️ السابق", disabled=page_index == 0)
         with col2:
+            next_page = st.form_submit_button("التالي ➡️", disabled=is_last_page)
+        with col3:
             save_draft = st.form_submit_button("💾 حفظ مسودة")
-        
-        if submitted or save_draft:
-            await process_survey_submission(
-                survey_id,
-                region_id,
-                fields,
-                answers,
-                submitted,
-                survey_name
-            )
-
-def render_field(field_id, label, field_type, options, is_required):
+        with col4:
+            submitted = st.form_submit_button("🚀 إرسال النموذج", disabled=not is_last_page)
+
+    # الاحتفاظ بإجابات الصفحة الحالية قبل الانتقال إلى صفحة أخرى
+    saved_answers.update(page_answers)
+
+    if previous_page or next_page:
+        st.session_state[page_key] = pages[page_index - 1 if previous_page else page_index + 1]
+        st.rerun()
+
+    if submitted or save_draft:
+        answers = {field[0]: saved_answers.get(field[0]) for field in fields}
+        if await process_survey_submission(
+            survey_id,
+            region_id,
+            fields,
+            answers,
+            submitted,
+            survey_name
+        ) and submitted:
+            st.session_state.pop(answers_key, None)
+            st.session_state.pop(page_key, None)
+            st.session_state.pop(draft_key, None)
+
+def parse_answer(field_type, value):
+    """تحويل الإجابة المخزنة نصيًا إلى قيمة مناسبة لنوع الحقل"""
+    if value in (None, ""):
+        return None
+    try:
+        if field_type == 'number':
+            return float(value)
+        if field_type == 'checkbox':
+            return value == "True"
+        if field_type == 'date':
+            return date.fromisoformat(value)
+    except ValueError:
+        return None
+    return value
+
+def render_field(field_id, label, field_type, options, is_required, value=None):
     required_mark = " *" if is_required else ""
     
     if field_type == 'text':
-        return st.text_input(label + required_mark, key=f"text_{field_id}")
+        return st.text_input(label + required_mark, value=value or "", key=f"text_{field_id}")
     elif field_type == 'number':
-        return st.number_input(label + required_mark, key=f"number_{field_id}")
+        return st.number_input(label + required_mark, value=value if value is not None else 0.0,
+                               key=f"number_{field_id}")
     elif field_type == 'dropdown':
         options_list = json.loads(options) if options else []
-        return st.selectbox(label + required_mark, options_list, key=f"dropdown_{field_id}")
+        return st.selectbox(label + required_mark, options_list,
+                            index=options_list.index(value) if value in options_list else 0,
+                            key=f"dropdown_{field_id}")
     elif field_type == 'checkbox':
-        return st.checkbox(label + required_mark, key=f"checkbox_{field_id}")
+        return st.checkbox(label + required_mark, value=bool(value), key=f"checkbox_{field_id}")
     elif field_type == 'date':
-        return st.date_input(label + required_mark, key=f"date_{field_id}")
+        return st.date_input(label + required_mark, value=value if value is not None else "today",
+                             key=f"date_{field_id}")
     else:
         st.warning(f"نوع الحقل غير معروف: {field_type}")
         return None
@@ -145,43 +304,61 @@ async def process_survey_submission(survey_id, region_id, fields, answers, is_co
     
     if missing_fields and is_completed:
         st.error(f"الحقول التالية مطلوبة: {', '.join(missing_fields)}")
-        return
+        return False
     
-    if is_completed and await db.has_completed_survey_today(st.session_state.user_id, survey_id):
+    if is_completed and await has_submitted_today(st.session_state.user_id, survey_id):
         st.error("لقد قمت بإكمال هذا الاستبيان اليوم بالفعل. يمكنك إكماله مرة أخرى غدًا.")
-        return
+        return False
+    
+    draft_key = f"survey_draft_{survey_id}"
+    draft = st.session_state.get(draft_key) or {'response_id': None, 'saved': {}}
+    values = {field_id: str(answer) for field_id, answer in answers.items() if answer is not None}
     
-    response_id = await db.save_response(
-        survey_id=survey_id,
-        user_id=st.session_state.user_id,
-        region_id=region_id,
-        is_completed=is_completed
+    if is_completed:
+        # يستلم صندوق الإرسال الاستبيان فوراً ويرسله إلى قاعدة البيانات في الخلفية
+        try:
+            submission_outbox.enqueue(st.session_state.user_id, survey_id, region_id, values, draft['response_id'])
+        except Exception as e:
+            st.error(f"حدث خطأ أثناء حفظ البيانات: {str(e)}")
+            return False
+        st.session_state.pop(draft_key, None)
+        refresh_employee_home()
+        show_submission_message(True, survey_name)
+        return True
+    
+    # المسودة محفوظة لكل (مستخدم، استبيان) ويكتب فقط ما تغير من إجاباتها
+    changed = {field_id: value for field_id, value in values.items() if draft['saved'].get(field_id) != value}
+    
+    response_id = draft['response_id'] or await db.create_draft(
+        survey_id, st.session_state.user_id, region_id
     )
     
-    if not response_id:
+    if not response_id or (changed and not await db.write_response_answers(
+            response_id, changed, draft['saved'].keys())):
         st.error("حدث خطأ أثناء حفظ البيانات")
-        return
+        return False
     
-    await save_response_details(response_id, answers)
-    show_submission_message(is_completed, survey_name)
+    st.session_state[draft_key] = {'response_id': response_id, 'saved': {**draft['saved'], **changed}}
+    show_submission_message(False, survey_name)
+    return True
+
+async def has_submitted_today(user_id, survey_id):
+    return (submission_outbox.has_pending_today(user_id, survey_id)
+            or await db.has_completed_survey_today(user_id, survey_id))
+
+def get_submitted_today(user_id, surveys):
+    """الاستبيانات المكتملة اليوم من بيانات الصفحة الرئيسية ومن صندوق الإرسال"""
+    completed = {survey_id for survey_id, survey in surveys.items() if survey['completed_today']}
+    return completed | submission_outbox.pending_today(user_id, list(surveys))
 
 def check_required_fields(fields, answers):
     missing_fields = []
     for field in fields:
-        field_id, label, _, _, is_required, _ = field
+        field_id, label, _, _, is_required, *_ = field
         if is_required and not answers.get(field_id):
             missing_fields.append(label)
     return missing_fields
 
-async def save_response_details(response_id, answers):
-    for field_id, answer in answers.items():
-        if answer is not None:
-            await db.save_response_detail(
-                response_id=response_id,
-                field_id=field_id,
-                answer_value=str(answer)
-            )
-
 def show_submission_message(is_completed, survey_name):
     if is_completed:
         st.success(f"تم إرسال استبيان '{survey_name}' بنجاح")
@@ -192,24 +369,8 @@ def show_submission_message(is_completed, survey_name):
     else:
         st.success(f"تم حفظ مسودة استبيان '{survey_name}' بنجاح")
 
-async def get_allowed_surveys(user_id):
-    try:
-        return await db.d1.fetch_all('''
-            SELECT s.survey_id, s.survey_name 
-            FROM Surveys s
-            JOIN UserSurveys us ON s.survey_id = us.survey_id
-            WHERE us.user_id = ?
-            ORDER BY s.survey_name
-        ''', (user_id,))
-    except Exception as e:
-        st.error(f"حدث خطأ في جلب الاستبيانات المسموح بها: {str(e)}")
-        return []
-
 async def view_survey_responses(survey_id):
-    survey = await db.d1.fetch_one(
-        "SELECT survey_name FROM Surveys WHERE survey_id=?",
-        (survey_id,)
-    )
+    survey = await db.get_survey_info(survey_id)
     
     st.subheader(f"إجابات استبيان {survey[0]} (عرض فقط)")
     
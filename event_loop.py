@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+class BackgroundLoop:
+    """حلقة أحداث واحدة طويلة العمر لكل عملية تعيش فيها الاتصالات والمهام بين عمليات إعادة التشغيل"""
+
+    def __init__(self, name: str = "background-loop"):
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """الحلقة المشتركة، وتُشغل عند أول استخدام"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name=self._name, daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def in_loop(self) -> bool:
+        """هل الكود الحالي يعمل داخل الحلقة المشتركة"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro: Coroutine) -> Future:
+        """جدولة دالة غير متزامنة على الحلقة المشتركة وإرجاع Future يمكن انتظاره من أي خيط"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """تشغيل دالة غير متزامنة على الحلقة المشتركة وانتظار نتيجتها من سياق متزامن"""
+        if self.in_loop():
+            coro.close()
+            raise RuntimeError("لا يمكن انتظار الحلقة المشتركة من داخلها")
+        return self.submit(coro).result(timeout)
+
+    async def call(self, coro: Coroutine) -> Any:
+        """انتظار دالة غير متزامنة على الحلقة المشتركة من أي حلقة أخرى دون حجزها"""
+        if self.in_loop():
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def stop(self):
+        """إيقاف الحلقة المشتركة"""
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+
+# نسخة واحدة لكل عملية تبقى بين عمليات إعادة تشغيل Streamlit
+background_loop = BackgroundLoop()
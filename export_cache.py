@@ -0,0 +1,79 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class ExportCache:
+    """تخزين ملفات التصدير على القرص مع حذف الأقدم استخداماً عند تجاوز الحجم المسموح"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(survey_id, scope, export_format, version) -> str:
+        """إنشاء مفتاح المحتوى من الاستبيان والنطاق والصيغة وإصدار البيانات"""
+        raw = f"{survey_id}|{scope if scope is not None else 'all'}|{export_format}|{'-'.join(map(str, version))}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """قراءة ملف مخزن وتحديث وقت استخدامه"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def put(self, key: str, data: bytes):
+        """حفظ ملف في الذاكرة المؤقتة ثم حذف الأقدم حتى لا يتجاوز الحجم الحد المسموح"""
+        if len(data) > self.max_bytes:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            self._evict()
+        except OSError as e:
+            # تعمل في مجمع الخيوط بعيداً عن الواجهة، فيُسجل الخطأ بدلاً من عرضه
+            logger.warning("خطأ في حفظ ملف التصدير المؤقت: %s", e)
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".bin"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+export_cache = ExportCache(
+    os.getenv('EXPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'survey_export_cache')),
+    int(os.getenv('EXPORT_CACHE_MAX_MB', '512')) * 1024 * 1024
+)
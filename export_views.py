@@ -0,0 +1,95 @@
+import re
+import streamlit as st
+from datetime import datetime
+from database import db
+from export_cache import export_cache
+from exports import run_export_job, EXPORT_FULL, EXPORT_WIDE_XLSX, EXPORT_WIDE_CSV, EXPORT_MIMES
+from jobs import job_manager, JOB_DONE, JOB_FAILED
+
+EXPORT_SUFFIXES = {
+    EXPORT_FULL: ("كامل", "xlsx"),
+    EXPORT_WIDE_XLSX: ("عريض", "xlsx"),
+    EXPORT_WIDE_CSV: ("عريض", "csv")
+}
+
+async def show_export_controls(survey_id, survey_name, governorate_id=None):
+    scope = f"{survey_id}_{governorate_id if governorate_id is not None else 'all'}"
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        export_full = st.button("تصدير شامل لجميع البيانات إلى Excel", key=f"export_excel_{scope}")
+    with col2:
+        export_wide_excel = st.button("تصدير جدول عريض (Excel)", key=f"export_wide_excel_{scope}")
+    with col3:
+        export_wide_csv = st.button("تصدير جدول عريض (CSV)", key=f"export_wide_csv_{scope}")
+
+    if export_full or export_wide_excel or export_wide_csv:
+        if export_full:
+            export_format = EXPORT_FULL
+        elif export_wide_excel:
+            export_format = EXPORT_WIDE_XLSX
+        else:
+            export_format = EXPORT_WIDE_CSV
+
+        label, extension = EXPORT_SUFFIXES[export_format]
+        file_name = (re.sub(r'[^\w\-_]', '_', survey_name) + f"_{label}_"
+                     + datetime.now().strftime("%Y%m%d_%H%M") + f".{extension}")
+
+        st.session_state.pop(f"export_result_{scope}", None)
+
+        # استخدام الملف المخزن إذا لم تتغير بيانات الاستبيان منذ إنشائه
+        version = await db.get_survey_data_version(survey_id)
+        cache_key = export_cache.make_key(survey_id, governorate_id, export_format, version) if version else None
+        cached = export_cache.get(cache_key) if cache_key else None
+
+        if cached is not None:
+            st.session_state[f"export_result_{scope}"] = {
+                'data': cached,
+                'file_name': file_name,
+                'mime': EXPORT_MIMES[export_format]
+            }
+        else:
+            st.session_state[f"export_job_{scope}"] = job_manager.submit(
+                "export", run_export_job, export_format, survey_id, file_name,
+                governorate_id, cache_key, owner=st.session_state.user_id
+            )
+
+    show_export_job(scope)
+
+def show_export_job(scope):
+    job_key = f"export_job_{scope}"
+    result_key = f"export_result_{scope}"
+
+    if job_key in st.session_state:
+        job = job_manager.get(st.session_state[job_key])
+        if job is None:
+            del st.session_state[job_key]
+        elif not job.finished:
+            st.progress(job.progress, text=job.message or "جاري التصدير...")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.button("🔄 تحديث الحالة", key=f"refresh_export_{scope}")
+            with col2:
+                if st.button("⛔ إلغاء التصدير", key=f"cancel_export_{scope}"):
+                    job_manager.cancel(job.job_id)
+                    st.rerun()
+        else:
+            job_manager.pop_result(job.job_id)
+            del st.session_state[job_key]
+            if job.status == JOB_DONE:
+                st.session_state[result_key] = job.result
+            elif job.status == JOB_FAILED:
+                st.error(f"حدث خطأ أثناء تصدير البيانات: {job.error}")
+            else:
+                st.info("تم إلغاء التصدير")
+
+    if result_key in st.session_state:
+        result = st.session_state[result_key]
+        st.download_button(
+            label="تنزيل ملف التصدير",
+            data=result['data'],
+            file_name=result['file_name'],
+            mime=result['mime'],
+            key=f"download_export_{scope}"
+        )
+        st.success("تم إنشاء ملف التصدير بنجاح")
@@ -0,0 +1,209 @@
+import json
+from io import BytesIO
+import pandas as pd
+from openpyxl import Workbook
+from database import db
+from export_cache import export_cache
+
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIME = "text/csv"
+EXPORT_PAGE_SIZE = 5000
+WIDE_CHUNK_SIZE = 5000
+
+EXPORT_FULL = 'full'
+EXPORT_WIDE_XLSX = 'wide_xlsx'
+EXPORT_WIDE_CSV = 'wide_csv'
+
+EXPORT_MIMES = {
+    EXPORT_FULL: EXCEL_MIME,
+    EXPORT_WIDE_XLSX: EXCEL_MIME,
+    EXPORT_WIDE_CSV: CSV_MIME
+}
+
+SUMMARY_COLUMNS = ["ID", "المستخدم", "الإدارة الصحية", "المحافظة", "تاريخ التقديم", "الحالة"]
+DETAILS_COLUMNS = ["ID الإجابة", "الحقل", "القيمة", "أدخلها", "تاريخ الإدخال", "حالة الإجابة"]
+FIELDS_COLUMNS = ["اسم الحقل", "نوع الحقل", "الخيارات", "مطلوب"]
+USERS_COLUMNS = ["المستخدم", "الإدارة الصحية", "المحافظة", "تاريخ التقديم", "الحالة"]
+
+def _status_label(is_completed):
+    return "مكتملة" if is_completed else "مسودة"
+
+async def _call_sync(run_sync, func, *args):
+    if run_sync is None:
+        return func(*args)
+    return await run_sync(func, *args)
+
+def _append_detail_rows(ws, page):
+    for _, response_id, label, answer, username, entry_date, is_completed, _ in page:
+        ws.append([response_id, label, answer, username, entry_date, _status_label(is_completed)])
+
+def _discard_workbook(wb):
+    # أوراق وضع الكتابة فقط تكتب صفوفها في ملفات مؤقتة لا تُحذف إلا عند الحفظ أو خروج العملية
+    for ws in wb.worksheets:
+        if ws._writer is None:
+            continue
+        if not ws.closed:
+            ws.close()
+        ws._writer.cleanup()
+
+async def write_survey_workbook(survey_id, responses, output, governorate_id=None,
+                                progress=None, run_sync=None):
+    """كتابة ملف Excel شامل لبيانات الاستبيان في وضع الكتابة فقط على دفعات"""
+    wb = Workbook(write_only=True)
+    try:
+        summary_ws = wb.create_sheet("ملخص_الإجابات")
+        details_ws = wb.create_sheet("تفاصيل_الإجابات")
+        fields_ws = wb.create_sheet("حقول_الاستبيان")
+        users_ws = wb.create_sheet("المستخدمين")
+
+        # ملخص الإجابات وقائمة المستخدمين بدون تكرار
+        summary_ws.append(SUMMARY_COLUMNS)
+        users_ws.append(USERS_COLUMNS)
+        seen_users = set()
+        for r in responses:
+            summary_ws.append([r[0], r[1], r[2], r[3], r[4], _status_label(r[5])])
+            user_row = (r[1], r[2], r[3], r[4], _status_label(r[5]))
+            if user_row not in seen_users:
+                seen_users.add(user_row)
+                users_ws.append(list(user_row))
+
+        # تفاصيل الإجابات صفحة بصفحة بدلاً من استعلام لكل إجابة
+        details_ws.append(DETAILS_COLUMNS)
+        rows_done = 0
+        async for page in db.iter_survey_response_details(survey_id, governorate_id, EXPORT_PAGE_SIZE):
+            await _call_sync(run_sync, _append_detail_rows, details_ws, page)
+            rows_done += len(page)
+            if progress:
+                progress(rows_done)
+
+        fields = await db.load_survey_fields(survey_id)
+        fields_ws.append(FIELDS_COLUMNS)
+        for field_id, label, field_type, options, is_required, *_ in fields:
+            options_list = json.loads(options) if options else []
+            fields_ws.append([label, field_type, "، ".join(options_list) if options_list else None,
+                              "نعم" if is_required else "لا"])
+
+        await _call_sync(run_sync, wb.save, output)
+    except BaseException:
+        _discard_workbook(wb)
+        raise
+    return output
+
+async def build_survey_workbook(survey_id, responses, governorate_id=None, progress=None, run_sync=None):
+    """إنشاء ملف Excel لبيانات الاستبيان في الذاكرة وإرجاع محتواه"""
+    buffer = BytesIO()
+    await write_survey_workbook(survey_id, responses, buffer, governorate_id, progress, run_sync)
+    return buffer.getvalue()
+
+def _pivot_wide(pages, fields, responses):
+    field_ids = [f[0] for f in fields]
+
+    if pages:
+        long_df = pd.concat(pages, ignore_index=True)
+    else:
+        long_df = pd.DataFrame(columns=["response_id", "field_id", "answer_value"])
+
+    # مفاتيح تصنيفية مرتبة حسب ترتيب الحقول حتى تخرج الأعمدة بنفس الترتيب
+    long_df["field_id"] = pd.Categorical(long_df["field_id"], categories=field_ids)
+    long_df = long_df.drop_duplicates(["response_id", "field_id"], keep="last")
+    wide = (long_df.set_index(["response_id", "field_id"])["answer_value"]
+            .unstack("field_id")
+            .reindex(columns=field_ids))
+
+    # تحويل الأعمدة إلى أنواعها الفعلية
+    for field_id, _, field_type, *_ in fields:
+        column = wide[field_id]
+        if field_type == 'number':
+            wide[field_id] = pd.to_numeric(column, errors="coerce")
+        elif field_type == 'date':
+            wide[field_id] = pd.to_datetime(column, errors="coerce")
+        elif field_type == 'checkbox':
+            wide[field_id] = column.map({"True": True, "False": False}).astype("boolean")
+
+    # أسماء أعمدة فريدة حتى لو تكررت تسميات الحقول
+    labels = []
+    for field_id, label, *_ in fields:
+        labels.append(label if label not in labels else f"{label} ({field_id})")
+    wide.columns = labels
+
+    summary = pd.DataFrame(
+        [(r[0], r[1], r[2], r[3], r[4], _status_label(r[5])) for r in responses],
+        columns=SUMMARY_COLUMNS
+    )
+    return summary.join(wide, on="ID", rsuffix=" (حقل)")
+
+async def build_wide_responses_frame(survey_id, responses, governorate_id=None,
+                                     progress=None, run_sync=None):
+    """إنشاء جدول عريض يحتوي على صف لكل إجابة وعمود لكل حقل"""
+    fields = await db.load_survey_fields(survey_id)
+
+    pages = []
+    rows_done = 0
+    async for page in db.iter_survey_response_details(survey_id, governorate_id, EXPORT_PAGE_SIZE):
+        pages.append(pd.DataFrame(
+            [(row[1], row[7], row[3]) for row in page],
+            columns=["response_id", "field_id", "answer_value"]
+        ))
+        rows_done += len(page)
+        if progress:
+            progress(rows_done)
+
+    return await _call_sync(run_sync, _pivot_wide, pages, fields, responses)
+
+def _iter_frame_rows(df, chunk_size=WIDE_CHUNK_SIZE):
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+def build_wide_workbook(wide_df):
+    """كتابة الجدول العريض في ملف Excel داخل الذاكرة"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("الإجابات")
+    ws.append(list(wide_df.columns))
+    for row in _iter_frame_rows(wide_df):
+        ws.append(list(row))
+
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+def build_wide_csv(wide_df):
+    """إنشاء ملف CSV للجدول العريض في الذاكرة"""
+    buffer = BytesIO()
+    # ترميز utf-8-sig يضيف علامة BOM حتى يتعرف Excel على الترميز العربي
+    wide_df.to_csv(buffer, index=False, encoding="utf-8-sig")
+    return buffer.getvalue()
+
+async def run_export_job(ctx, export_format, survey_id, file_name, governorate_id=None,
+                         cache_key=None):
+    """مهمة خلفية لإنشاء ملف التصدير مع الإبلاغ عن التقدم"""
+    # أخطاء الجلب تُفشل المهمة بدلاً من إنتاج ملف ناقص
+    responses = await db.load_survey_responses(survey_id, governorate_id)
+    fields = await db.load_survey_fields(survey_id)
+    expected_rows = max(len(responses) * len(fields), 1)
+
+    def on_progress(rows_done):
+        ctx.check_cancelled()
+        ctx.report(0.9 * min(rows_done / expected_rows, 1.0), f"تمت معالجة {rows_done} إجابة")
+
+    ctx.report(0.0, "جاري تجهيز البيانات")
+    if export_format == EXPORT_FULL:
+        data = await build_survey_workbook(survey_id, responses, governorate_id,
+                                           on_progress, ctx.run_in_pool)
+        mime = EXCEL_MIME
+    else:
+        wide_df = await build_wide_responses_frame(survey_id, responses, governorate_id,
+                                                   on_progress, ctx.run_in_pool)
+        ctx.report(0.95, "جاري كتابة الملف")
+        if export_format == EXPORT_WIDE_XLSX:
+            data, mime = await ctx.run_in_pool(build_wide_workbook, wide_df), EXCEL_MIME
+        else:
+            data, mime = await ctx.run_in_pool(build_wide_csv, wide_df), CSV_MIME
+
+    # لا يصل التنفيذ إلى هنا إلا إذا جُلبت جميع البيانات وبُني الملف دون أخطاء،
+    # فلا يُخزن ملف ناقص تحت مفتاح إصدار البيانات الحالي
+    if cache_key:
+        await ctx.run_in_pool(export_cache.put, cache_key, data)
+
+    return {'data': data, 'file_name': file_name, 'mime': mime}
@@ -0,0 +1,47 @@
+import asyncio
+import functools
+import threading
+import streamlit as st
+from streamlit.errors import StreamlitAPIException
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+def run_sync(coro):
+    """تشغيل دالة غير متزامنة حتى نهايتها من سياق متزامن"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # إعادة تشغيل الجزء وحده لا تمر عبر حلقة الأحداث الرئيسية
+        return asyncio.run(coro)
+
+    # أثناء التشغيل الكامل تكون حلقة الأحداث مشغولة، فنشغل الدالة في خيط مرتبط بسياق الجلسة
+    outcome = {}
+
+    def target():
+        try:
+            outcome['value'] = asyncio.run(coro)
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target)
+    add_script_run_ctx(thread, get_script_run_ctx())
+    thread.start()
+    thread.join()
+
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('value')
+
+def async_fragment(func):
+    """تحويل دالة عرض غير متزامنة إلى جزء يعاد تشغيله بشكل مستقل عن باقي الصفحة"""
+    @st.fragment
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return run_sync(func(*args, **kwargs))
+    return wrapper
+
+def rerun_fragment():
+    """إعادة تشغيل الجزء الحالي فقط، أو الصفحة كاملة إذا لم يكن التشغيل الحالي خاصاً بالجزء"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
@@ -1,7 +1,13 @@
 import streamlit as st
 import pandas as pd
-import json
+from datetime import datetime, timezone
 from database import db
+from navigation import show_active_section
+from response_browser import show_response_filters, load_response_stats, show_response_page
+from export_views import show_export_controls
+from response_editor import show_response_editor
+from fragments import async_fragment, rerun_fragment
+from loaders import load_all
 
 async def show_governorate_admin_dashboard():
     if st.session_state.get('role') != 'governorate_admin':
@@ -20,18 +26,12 @@ async def show_governorate_admin_dashboard():
     st.title(f"لوحة تحكم محافظة {governorate_name}")
     st.markdown(f"**وصف المحافظة:** {description}")
     
-    tab1, tab2, tab3 = st.tabs([
-        "📋 إدارة الاستبيانات",
-        "📊 عرض البيانات",
-        "👥 إدارة الموظفين"
-    ])
-    
-    with tab1:
-        await manage_governorate_surveys(governorate_id, governorate_name)
-    with tab2:
-        await view_governorate_data(governorate_id, governorate_name)
-    with tab3:
-        await manage_governorate_employees(governorate_id, governorate_name)
+    await show_active_section({
+        "📋 إدارة الاستبيانات": lambda: manage_governorate_surveys(governorate_id, governorate_name),
+        "📊 عرض البيانات": lambda: view_governorate_data(governorate_id, governorate_name),
+        "📝 متابعة الإرسال اليومي": lambda: track_missing_submissions(governorate_id, governorate_name),
+        "👥 إدارة الموظفين": lambda: manage_governorate_employees(governorate_id, governorate_name)
+    }, key="governorate_admin_section")
 
 async def manage_governorate_surveys(governorate_id, governorate_name):
     st.subheader(f"إدارة استبيانات محافظة {governorate_name}")
@@ -63,14 +63,41 @@ async def manage_governorate_surveys(governorate_id, governorate_name):
     if st.button("تعديل حالة الاستبيان", key=f"edit_{survey_id}"):
         st.session_state.editing_survey = survey_id
         st.rerun()
+    
+    await bulk_survey_access(survey_id, selected_survey[1], governorate_id)
+
+async def bulk_survey_access(survey_id, survey_name, governorate_id):
+    st.markdown(f"#### صلاحية استبيان {survey_name} لجميع الموظفين")
+    
+    health_admins = await db.get_health_admins_by_governorate(governorate_id)
+    
+    with st.form(f"bulk_access_{survey_id}"):
+        admin_id = st.selectbox(
+            "الإدارة الصحية",
+            options=[None] + [a[0] for a in health_admins],
+            format_func=lambda x: "جميع إدارات المحافظة" if x is None else next(a[1] for a in health_admins if a[0] == x)
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            assign_btn = st.form_submit_button("✅ منح الاستبيان للجميع")
+        with col2:
+            revoke_btn = st.form_submit_button("🚫 سحب الاستبيان من الجميع")
+    
+    if assign_btn:
+        count = await db.assign_survey_to_employees(survey_id, governorate_id, admin_id)
+        if count is not None:
+            st.success(f"تم منح الاستبيان لـ {count} موظف")
+    
+    if revoke_btn:
+        count = await db.revoke_survey_from_employees(survey_id, governorate_id, admin_id)
+        if count is not None:
+            st.success(f"تم سحب الاستبيان من {count} موظف")
 
 async def edit_governorate_survey(survey_id, governorate_id):
     st.subheader("تعديل حالة الاستبيان")
     
-    survey = await db.d1.fetch_one(
-        "SELECT survey_name, is_active FROM Surveys WHERE survey_id=?",
-        (survey_id,)
-    )
+    survey = await db.get_survey_info(survey_id)
     
     with st.form(f"edit_survey_{survey_id}"):
         st.text_input("اسم الاستبيان", value=survey[0], disabled=True)
@@ -115,111 +142,88 @@ async def view_governorate_data(governorate_id, governorate_name):
     if selected_survey:
         await view_survey_responses(selected_survey[0], governorate_id)
 
-async def view_survey_responses(survey_id, governorate_id):
-    survey = await db.d1.fetch_one(
-        "SELECT survey_name FROM Surveys WHERE survey_id=?",
-        (survey_id,)
+async def track_missing_submissions(governorate_id, governorate_name):
+    st.header(f"الموظفون الذين لم يرسلوا في محافظة {governorate_name}")
+    
+    surveys = await db.get_governorate_surveys(governorate_id)
+    
+    if not surveys:
+        st.info("لا توجد استبيانات لهذه المحافظة")
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        selected_survey = st.selectbox(
+            "اختر استبيان",
+            surveys,
+            format_func=lambda x: x[1],
+            key="missing_survey_select"
+        )
+    with col2:
+        # نفس توقيت DATE('now') في قاعدة البيانات
+        day = st.date_input("اليوم", value=datetime.now(timezone.utc).date(), key="missing_day")
+    
+    data = await load_all(
+        status=db.get_submission_status_by_admin(selected_survey[0], governorate_id, day),
+        missing=db.get_missing_submissions(selected_survey[0], governorate_id, day)
     )
     
+    if not data['status']:
+        st.info("لا يوجد موظفون لديهم صلاحية هذا الاستبيان")
+        return
+    
+    assigned = sum(row[2] for row in data['status'])
+    missing_count = sum(row[3] for row in data['status'])
+    col1, col2, col3 = st.columns(3)
+    col1.metric("الموظفون المكلفون", assigned)
+    col2.metric("أرسلوا", assigned - missing_count)
+    col3.metric("لم يرسلوا", missing_count)
+    
+    if not data['missing']:
+        st.success("جميع الموظفين أرسلوا هذا الاستبيان")
+        return
+    
+    missing = pd.DataFrame(data['missing'], columns=["admin_id", "الإدارة الصحية", "user_id", "اسم المستخدم", "آخر دخول"])
+    for admin_id, admin_name, admin_assigned, admin_missing in data['status']:
+        if not admin_missing:
+            continue
+        with st.expander(f"{admin_name} - لم يرسل {admin_missing} من {admin_assigned}"):
+            st.dataframe(
+                missing.loc[missing["admin_id"] == admin_id, ["اسم المستخدم", "آخر دخول"]],
+                use_container_width=True,
+                hide_index=True
+            )
+
+async def view_survey_responses(survey_id, governorate_id):
+    survey = await db.get_survey_info(survey_id)
+    
     st.subheader(f"إجابات استبيان {survey[0]}")
     
-    responses = await db.d1.fetch_all('''
-        SELECT r.response_id, u.username, ha.admin_name, 
-               r.submission_date, r.is_completed
-        FROM Responses r
-        JOIN Users u ON r.user_id = u.user_id
-        JOIN HealthAdministrations ha ON r.region_id = ha.admin_id
-        WHERE r.survey_id = ? AND ha.governorate_id = ?
-        ORDER BY r.submission_date DESC
-    ''', (survey_id, governorate_id))
-    
-    if not responses:
+    version = await db.get_survey_data_version(survey_id)
+    scope_filters = {'governorate_id': governorate_id}
+    total = (await load_response_stats(survey_id, scope_filters, version))[0]
+    
+    if not total:
         st.info("لا توجد إجابات مسجلة لهذا الاستبيان في محافظتك")
         return
     
-    total = len(responses)
-    completed = sum(1 for r in responses if r[4])
+    key_prefix = f"gov_responses_{survey_id}_{governorate_id}"
+    filters = await show_response_filters(key_prefix, governorate_id)
+    filtered_total, completed, _ = await load_response_stats(survey_id, filters, version)
     
     col1, col2, col3 = st.columns(3)
-    col1.metric("إجمالي الإجابات", total)
+    col1.metric("إجمالي الإجابات", filtered_total)
     col2.metric("الإجابات المكتملة", completed)
-    col3.metric("نسبة الإكمال", f"{round((completed/total)*100)}%")
+    col3.metric("نسبة الإكمال", f"{round((completed/filtered_total)*100) if filtered_total else 0}%")
     
-    df = pd.DataFrame(
-        [(r[0], r[1], r[2], r[3], "✔️" if r[4] else "✖️") 
-         for r in responses],
-        columns=["ID", "المستخدم", "الإدارة الصحية", "التاريخ", "الحالة"]
+    selected_response_id = await show_response_page(
+        survey_id, filters, filtered_total, key_prefix, show_governorate=False, version=version
     )
     
-    st.dataframe(df, use_container_width=True)
-    
-    selected_response_id = st.selectbox(
-        "اختر إجابة لعرض وتعديل تفاصيلها",
-        options=[r[0] for r in responses],
-        format_func=lambda x: f"إجابة #{x}",
-        key=f"response_select_{survey_id}_{governorate_id}"
-    )
+    await show_export_controls(survey_id, survey[0], governorate_id)
 
     if selected_response_id:
-        response_info = await db.get_response_info(selected_response_id)
-        if response_info:
-            st.subheader(f"تفاصيل الإجابة #{selected_response_id}")
-            st.markdown(f"""
-            **الاستبيان:** {response_info[1]}  
-            **المستخدم:** {response_info[2]}  
-            **الإدارة الصحية:** {response_info[3]}  
-            **المحافظة:** {response_info[4]}  
-            **تاريخ التقديم:** {response_info[5]}
-            """)
-            
-            details = await db.get_response_details(selected_response_id)
-            updates = {}
-            
-            with st.form(key=f"edit_response_{survey_id}_{governorate_id}_{selected_response_id}"):
-                for detail in details:
-                    detail_id, field_id, label, field_type, options, answer = detail
-                    
-                    col1, col2 = st.columns([1, 3])
-                    with col1:
-                        st.markdown(f"**{label}**")
-                    with col2:
-                        if field_type == 'dropdown':
-                            options_list = json.loads(options) if options else []
-                            new_value = st.selectbox(
-                                f"تعديل {label}",
-                                options_list,
-                                index=options_list.index(answer) if answer in options_list else 0,
-                                key=f"edit_dropdown_{detail_id}_{selected_response_id}"
-                            )
-                        else:
-                            new_value = st.text_input(
-                                f"تعديل {label}",
-                                value=answer,
-                                key=f"edit_input_{detail_id}_{selected_response_id}"
-                            )
-                        
-                        if new_value != answer:
-                            updates[detail_id] = new_value
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.form_submit_button("💾 حفظ جميع التعديلات"):
-                        if updates:
-                            success_count = 0
-                            for detail_id, new_value in updates.items():
-                                if await db.update_response_detail(detail_id, new_value):
-                                    success_count += 1
-                            
-                            if success_count == len(updates):
-                                st.success("تم تحديث جميع التعديلات بنجاح")
-                            else:
-                                st.error(f"تم تحديث {success_count} من أصل {len(updates)} تعديلات")
-                            st.rerun()
-                        else:
-                            st.info("لم تقم بإجراء أي تعديلات")
-                with col2:
-                    if st.form_submit_button("❌ إلغاء التعديلات"):
-                        st.rerun()
+        show_response_editor(selected_response_id, f"gov_{survey_id}_{governorate_id}")
 
 async def manage_governorate_employees(governorate_id, governorate_name):
     st.header(f"إدارة موظفي محافظة {governorate_name}")
@@ -247,31 +251,40 @@ async def manage_governorate_employees(governorate_id, governorate_name):
                     st.session_state.editing_employee = user_id
     
     if 'editing_employee' in st.session_state:
-        await edit_employee(st.session_state.editing_employee, governorate_id)
+        edit_employee(st.session_state.editing_employee, governorate_id)
 
+@async_fragment
 async def edit_employee(user_id, governorate_id):
+    if st.session_state.get('editing_employee') != user_id:
+        return
+
     st.subheader("تعديل بيانات الموظف")
     
-    employee = await db.d1.fetch_one('''
-        SELECT u.username, u.assigned_region, ha.admin_name
-        FROM Users u
-        JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
-        WHERE u.user_id = ?
-    ''', (user_id,))
+    data = await load_all(
+        employee=db.d1.fetch_one('''
+            SELECT u.username, u.assigned_region, ha.admin_name
+            FROM Users u
+            JOIN HealthAdministrations ha ON u.assigned_region = ha.admin_id
+            WHERE u.user_id = ?
+        ''', (user_id,)),
+        health_admins=db.d1.fetch_all('''
+            SELECT admin_id, admin_name FROM HealthAdministrations
+            WHERE governorate_id = ?
+            ORDER BY admin_name
+        ''', (governorate_id,)),
+        surveys=db.get_governorate_surveys(governorate_id),
+        allowed_surveys=db.get_user_allowed_surveys(user_id)
+    )
+    employee = data['employee']
     
     if not employee:
         st.error("الموظف غير موجود")
         del st.session_state.editing_employee
         return
     
-    health_admins = await db.d1.fetch_all('''
-        SELECT admin_id, admin_name FROM HealthAdministrations
-        WHERE governorate_id = ?
-        ORDER BY admin_name
-    ''', (governorate_id,))
-    
-    surveys = await db.get_governorate_surveys(governorate_id)
-    allowed_surveys = await db.get_user_allowed_surveys(user_id)
+    health_admins = data['health_admins']
+    surveys = data['surveys']
+    allowed_surveys = data['allowed_surveys']
     allowed_survey_ids = [s[0] for s in allowed_surveys]
     survey_ids = [s[0] for s in surveys]
     valid_allowed_survey_ids = [sid for sid in allowed_survey_ids if sid in survey_ids]
@@ -304,12 +317,19 @@ async def edit_employee(user_id, governorate_id):
             cancel_btn = st.form_submit_button("❌ إلغاء")
         
         if submit_btn:
-            await db.update_user(user_id, employee[0], 'employee', selected_admin)
-            if await db.update_user_allowed_surveys(user_id, selected_surveys):
+            try:
+                async with db.unit_of_work() as uow:
+                    saved = (await db.update_user(user_id, employee[0], 'employee', selected_admin, uow=uow)
+                             and await db.update_user_allowed_surveys(user_id, selected_surveys, uow=uow))
+            except Exception as e:
+                st.error(f"حدث خطأ في تحديث بيانات الموظف: {str(e)}")
+                saved = False
+            
+            if saved:
                 st.success("تم تحديث بيانات الموظف بنجاح")
                 del st.session_state.editing_employee
-                st.rerun()
+                rerun_fragment()
         
         if cancel_btn:
             del st.session_state.editing_employee
-            st.rerun()
\ No newline at end of file
+            rerun_fragment()
\ No newline at end of file
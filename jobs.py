@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from event_loop import background_loop
+from cloudflare import d1_priority, PRIORITY_BULK
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+class JobCancelled(Exception):
+    """يتم رفعه داخل المهمة عند طلب إلغائها"""
+
+class Job:
+    def __init__(self, name: str, owner: Any = None):
+        self.job_id = uuid.uuid4().hex
+        self.name = name
+        self.owner = owner
+        self.status = JOB_PENDING
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_requested = threading.Event()
+        self.task = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+class JobContext:
+    """الواجهة التي تستخدمها المهمة للإبلاغ عن التقدم والتحقق من الإلغاء"""
+
+    def __init__(self, manager: 'JobManager', job: Job):
+        self._manager = manager
+        self._job = job
+
+    @property
+    def job_id(self) -> str:
+        return self._job.job_id
+
+    @property
+    def cancelled(self) -> bool:
+        return self._job.cancel_requested.is_set()
+
+    def check_cancelled(self):
+        """رفع JobCancelled إذا طُلب إلغاء المهمة"""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def report(self, progress: Optional[float] = None, message: Optional[str] = None):
+        """تحديث نسبة التقدم (من 0 إلى 1) ورسالة الحالة"""
+        with self._manager._lock:
+            if progress is not None:
+                self._job.progress = min(max(float(progress), 0.0), 1.0)
+            if message is not None:
+                self._job.message = message
+
+    async def run_in_pool(self, func: Callable, *args, **kwargs):
+        """تشغيل عمل كثيف المعالجة في مجمع الخيوط بعيداً عن حلقة الأحداث"""
+        self.check_cancelled()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._manager._pool, lambda: func(*args, **kwargs))
+
+class JobManager:
+    """تشغيل المهام الطويلة في الخلفية مع حفظ نتائجها لإعادة التشغيل اللاحقة"""
+
+    def __init__(self, max_workers: int = 4, max_concurrent_jobs: int = 4, result_ttl: int = 3600):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+        self._max_concurrent_jobs = max_concurrent_jobs
+        self._result_ttl = result_ttl
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._semaphore = None
+
+    def submit(self, name: str, func: Callable, *args, owner: Any = None, **kwargs) -> str:
+        """جدولة دالة غير متزامنة func(ctx, *args, **kwargs) وإرجاع معرف المهمة"""
+        self._purge_expired()
+        job = Job(name, owner)
+        with self._lock:
+            self._jobs[job.job_id] = job
+
+        job.task = background_loop.submit(self._run(job, func, args, kwargs))
+        # مهمة أُلغيت قبل أن تبدأ لا تصل إلى كتلة try داخل _run
+        job.task.add_done_callback(lambda _: job.finished or self._finish(job, JOB_CANCELLED))
+        return job.job_id
+
+    async def _run(self, job: Job, func: Callable, args, kwargs):
+        ctx = JobContext(self, job)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrent_jobs)
+        try:
+            async with self._semaphore:
+                ctx.check_cancelled()
+                with self._lock:
+                    job.status = JOB_RUNNING
+                # مهام الخلفية مجمعة بطبيعتها فلا تزاحم طلبات المستخدمين التفاعلية
+                with d1_priority(PRIORITY_BULK):
+                    result = await func(ctx, *args, **kwargs)
+        except (JobCancelled, asyncio.CancelledError):
+            self._finish(job, JOB_CANCELLED)
+        except Exception as e:
+            self._finish(job, JOB_FAILED, error=str(e))
+        else:
+            self._finish(job, JOB_DONE, result=result)
+
+    def _finish(self, job: Job, status: str, result=None, error=None):
+        with self._lock:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            if status == JOB_DONE:
+                job.progress = 1.0
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """الحصول على حالة مهمة"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self, owner: Any = None) -> List[Job]:
+        """الحصول على مهام مستخدم معين أو جميع المهام"""
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if owner is None or j.owner == owner]
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> bool:
+        """طلب إلغاء مهمة قيد الانتظار أو التشغيل"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_requested.set()
+        if job.task is not None:
+            job.task.cancel()
+        return True
+
+    def pop_result(self, job_id: str):
+        """استلام نتيجة مهمة منتهية وحذفها من مخزن النتائج"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.finished:
+                return None
+            del self._jobs[job_id]
+            return job
+
+    def _purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished_at > self._result_ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def shutdown(self):
+        """إلغاء المهام الجارية وإيقاف مجمع الخيوط"""
+        for job in self.list_jobs():
+            self.cancel(job.job_id)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# نسخة واحدة لكل عملية تبقى بين عمليات إعادة تشغيل Streamlit
+job_manager = JobManager()
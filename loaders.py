@@ -0,0 +1,99 @@
+import asyncio
+import os
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List
+from event_loop import background_loop
+
+# الحد الأقصى للاستعلامات المتزامنة لكل صفحة حتى لا تُغرق قاعدة البيانات
+MAX_CONCURRENT_QUERIES = int(os.getenv('MAX_CONCURRENT_QUERIES', '8'))
+
+async def load_all(limit=MAX_CONCURRENT_QUERIES, **queries):
+    """تشغيل استعلامات الصفحة المستقلة بالتوازي وإرجاع نتائجها بنفس أسمائها.
+    مثال: data = await load_all(users=db.get_users(), surveys=db.get_surveys())"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def limited(query):
+        async with semaphore:
+            return await query
+
+    results = await asyncio.gather(*(limited(query) for query in queries.values()))
+    return dict(zip(queries.keys(), results))
+
+class BatchLoader:
+    """تجميع المفاتيح المطلوبة في نفس دورة حلقة الأحداث وجلبها باستعلام واحد مع حفظ النتائج طوال الطلب"""
+
+    def __init__(self, batch_fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+                 max_batch: int = 100):
+        self._batch_fn = batch_fn
+        self._max_batch = max_batch
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Hashable] = []
+        self._tasks = set()
+
+    def load(self, key: Hashable) -> Awaitable[Any]:
+        """طلب قيمة مفتاح؛ الطلبات المتكررة لنفس المفتاح تعيد نفس النتيجة"""
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._queue.append(key)
+            if len(self._queue) == 1:
+                # التنفيذ بعد أن تصل باقي المهام الجاهزة في نفس الدورة إلى طلباتها
+                loop.call_soon(self._dispatch)
+        return asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Any]:
+        """طلب عدة مفاتيح وإرجاع قيمها بنفس الترتيب"""
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: Hashable, value: Any):
+        """حفظ قيمة معروفة مسبقاً دون استعلام"""
+        if key not in self._futures:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._futures[key] = future
+
+    def clear(self, key: Hashable = None):
+        """حذف قيمة محفوظة بعد تعديلها، أو جميع القيم"""
+        if key is None:
+            self._futures = {k: f for k, f in self._futures.items() if not f.done()}
+        elif key in self._futures and self._futures[key].done():
+            del self._futures[key]
+
+    def _dispatch(self):
+        keys, self._queue = self._queue, []
+        for start in range(0, len(keys), self._max_batch):
+            task = asyncio.ensure_future(self._resolve(keys[start:start + self._max_batch]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, keys: List[Hashable]):
+        try:
+            values = await self._batch_fn(keys)
+        except Exception as e:
+            for key in keys:
+                # لا تُحفظ الأخطاء حتى يمكن إعادة المحاولة في نفس الطلب
+                future = self._futures.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+                    # تجنب تحذير الاستثناء غير المسترجع إذا ألغي كل من ينتظره
+                    future.exception()
+            return
+        for key in keys:
+            future = self._futures[key]
+            if not future.done():
+                future.set_result(values.get(key))
+
+# محمّلات كل طلب؛ كل إعادة تشغيل للصفحة أو لجزء منها تعمل في حلقة أحداث خاصة بها
+_request_loaders = weakref.WeakKeyDictionary()
+
+def request_loader(name: str, batch_fn, max_batch: int = 100) -> BatchLoader:
+    """محمّل الطلب الحالي لنوع معين من البيانات، يُنشأ عند أول استخدام في الطلب"""
+    if background_loop.in_loop():
+        # الحلقة المشتركة لا تنتهي، فلا تُحفظ فيها النتائج بين المهام
+        return BatchLoader(batch_fn, max_batch)
+    loaders = _request_loaders.setdefault(asyncio.get_running_loop(), {})
+    if name not in loaders:
+        loaders[name] = BatchLoader(batch_fn, max_batch)
+    return loaders[name]
@@ -0,0 +1,8 @@
+import streamlit as st
+
+async def show_active_section(sections, key):
+    """عرض قائمة الأقسام وتشغيل القسم النشط فقط بدلاً من تشغيل جميع التبويبات"""
+    labels = list(sections.keys())
+    active = st.radio("القسم", labels, horizontal=True, key=key, label_visibility="collapsed")
+    st.divider()
+    await sections[active]()
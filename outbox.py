@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from typing import Any, Dict, List, Optional
+from event_loop import background_loop
+from cloudflare import d1_priority, PRIORITY_WRITE
+
+class SubmissionOutbox:
+    """صندوق إرسال محلي دائم يستقبل الاستبيانات فوراً ثم يرسلها إلى قاعدة البيانات في الخلفية"""
+
+    def __init__(self, path: str, batch_size: int = 20, interval: float = 5.0,
+                 lease_seconds: float = 120.0, max_backoff: float = 600.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._task = None
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            with self._lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS outbox (
+                        outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        submission_key TEXT NOT NULL UNIQUE,
+                        user_id INTEGER NOT NULL,
+                        survey_id INTEGER NOT NULL,
+                        payload TEXT NOT NULL,
+                        submitted_at TEXT NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at REAL NOT NULL DEFAULT 0,
+                        lease_until REAL NOT NULL DEFAULT 0,
+                        last_error TEXT
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_user ON outbox(user_id, survey_id)")
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def enqueue(self, user_id: int, survey_id: int, region_id: int, answers: Dict[int, str],
+                response_id: Optional[int] = None) -> str:
+        """حفظ استبيان مكتمل في الصندوق وإرجاع مفتاح عدم التكرار الخاص به"""
+        return self.enqueue_many([{
+            'user_id': user_id,
+            'survey_id': survey_id,
+            'region_id': region_id,
+            'answers': answers,
+            'response_id': response_id
+        }])[0]
+
+    def enqueue_many(self, submissions: List[Dict[str, Any]]) -> List[str]:
+        """حفظ عدة استبيانات مكتملة في معاملة واحدة وإرجاع مفاتيحها بنفس الترتيب"""
+        submitted_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        rows = []
+        for submission in submissions:
+            payload = {
+                'submission_key': uuid.uuid4().hex,
+                'user_id': submission['user_id'],
+                'survey_id': submission['survey_id'],
+                'region_id': submission['region_id'],
+                'response_id': submission.get('response_id'),
+                'answers': {str(field_id): value for field_id, value in submission['answers'].items()},
+                'submitted_at': submitted_at
+            }
+            rows.append((payload['submission_key'], payload['user_id'], payload['survey_id'],
+                         json.dumps(payload), submitted_at))
+
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                """INSERT INTO outbox (submission_key, user_id, survey_id, payload, submitted_at)
+                   VALUES (?, ?, ?, ?, ?)""", rows)
+            conn.commit()
+
+        self.start()
+        self.wake()
+        return [row[0] for row in rows]
+
+    def pending_today(self, user_id: int, survey_ids: List[int]) -> set:
+        """الاستبيانات المكتملة للمستخدم اليوم والتي لم تُرسل بعد"""
+        if not survey_ids:
+            return set()
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"""SELECT DISTINCT survey_id FROM outbox
+                    WHERE user_id = ? AND survey_id IN ({', '.join('?' * len(survey_ids))})
+                      AND DATE(submitted_at) = DATE('now')""",
+                [user_id] + list(survey_ids)).fetchall()
+        return {row[0] for row in rows}
+
+    def has_pending_today(self, user_id: int, survey_id: int) -> bool:
+        """هل يوجد استبيان مكتمل لم يُرسل بعد للمستخدم اليوم"""
+        return bool(self.pending_today(user_id, [survey_id]))
+
+    def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """حجز دفعة من الاستبيانات المستحقة حتى لا ترسلها عملية أخرى في نفس الوقت"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                """UPDATE outbox SET lease_until = ?
+                   WHERE outbox_id IN (
+                       SELECT outbox_id FROM outbox
+                       WHERE next_attempt_at <= ? AND lease_until <= ?
+                       ORDER BY outbox_id LIMIT ?
+                   )
+                   RETURNING outbox_id, payload""",
+                (now + self.lease_seconds, now, now, limit)).fetchall()
+            conn.commit()
+        return [{'outbox_id': row[0], **json.loads(row[1])} for row in rows]
+
+    def complete(self, outbox_id: int):
+        """حذف استبيان تم إرساله بنجاح"""
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM outbox WHERE outbox_id = ?", (outbox_id,))
+            conn.commit()
+
+    def complete_many(self, outbox_ids: List[int]):
+        """حذف عدة استبيانات تم إرسالها بنجاح في معاملة واحدة"""
+        with closing(self._connect()) as conn:
+            conn.executemany("DELETE FROM outbox WHERE outbox_id = ?", [(outbox_id,) for outbox_id in outbox_ids])
+            conn.commit()
+
+    def fail(self, outbox_id: int, error: str):
+        """تسجيل فشل الإرسال وجدولة محاولة لاحقة بفاصل يتضاعف"""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                """UPDATE outbox
+                   SET attempts = attempts + 1,
+                       next_attempt_at = ? + MIN(?, 5 * (1 << MIN(attempts, 16))),
+                       lease_until = 0,
+                       last_error = ?
+                   WHERE outbox_id = ?""",
+                (time.time(), self.max_backoff, error[:500], outbox_id))
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """عدد الاستبيانات المنتظرة والمعاد محاولتها وعمر أقدمها"""
+        with closing(self._connect()) as conn:
+            depth, retrying, oldest = conn.execute(
+                """SELECT COUNT(*), COALESCE(SUM(attempts > 0), 0), MIN(outbox_id)
+                   FROM outbox""").fetchone()
+            oldest_at = None
+            if oldest is not None:
+                oldest_at = conn.execute(
+                    "SELECT submitted_at FROM outbox WHERE outbox_id = ?", (oldest,)).fetchone()[0]
+        return {'depth': depth, 'retrying': retrying, 'oldest_submitted_at': oldest_at}
+
+    def list_pending(self, limit: int = 100) -> List[tuple]:
+        """أقدم الاستبيانات المنتظرة مع عدد المحاولات وآخر خطأ"""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                """SELECT submission_key, user_id, survey_id, submitted_at, attempts, last_error
+                   FROM outbox ORDER BY outbox_id LIMIT ?""", (limit,)).fetchall()
+
+    async def drain_once(self) -> int:
+        """إرسال دفعة واحدة من الاستبيانات المستحقة وإرجاع عدد ما تم إرساله"""
+        from database import db
+
+        # عمليات الملف المحلي تعمل في خيط منفصل حتى لا تحجز الحلقة المشتركة
+        batch = await asyncio.to_thread(self.claim, self.batch_size)
+
+        if not batch:
+            return 0
+
+        # الدفعة كلها في طلب واحد، وإرسال الموظف له الأولوية على كل طلبات قاعدة البيانات الأخرى
+        try:
+            with d1_priority(PRIORITY_WRITE):
+                await db.apply_submissions(batch)
+        except Exception:
+            pass
+        else:
+            await asyncio.to_thread(self.complete_many, [submission['outbox_id'] for submission in batch])
+            return len(batch)
+
+        # عند فشل الدفعة يُرسل كل استبيان وحده حتى لا يمنع استبيان فاسد إرسال الباقي
+        async def deliver(submission):
+            try:
+                with d1_priority(PRIORITY_WRITE):
+                    await db.apply_submission(submission)
+            except Exception as e:
+                await asyncio.to_thread(self.fail, submission['outbox_id'], str(e))
+                return False
+            await asyncio.to_thread(self.complete, submission['outbox_id'])
+            return True
+
+        results = await asyncio.gather(*(deliver(submission) for submission in batch))
+        return sum(results)
+
+    async def _drain_forever(self):
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                # الاستمرار ما دامت الدفعات ممتلئة
+                while await self.drain_once() == self.batch_size:
+                    pass
+            except Exception:
+                # أي خطأ غير متوقع لا يوقف الإرسال؛ تبقى الاستبيانات في الصندوق
+                pass
+
+    def start(self):
+        """تشغيل الإرسال في الخلفية على الحلقة المشتركة مرة واحدة لكل عملية"""
+        with self._lock:
+            if self._task is None:
+                self._task = background_loop.submit(self._drain_forever())
+
+    def wake(self):
+        """طلب محاولة إرسال فورية"""
+        if self._wake is not None:
+            background_loop.loop.call_soon_threadsafe(self._wake.set)
+
+submission_outbox = SubmissionOutbox(os.getenv('OUTBOX_PATH', 'survey_outbox.sqlite3'))
@@ -0,0 +1,113 @@
+import streamlit as st
+import pandas as pd
+from database import db
+from response_cache import load_for_version
+
+PAGE_SIZES = [25, 50, 100, 200]
+STATUS_OPTIONS = {"الكل": None, "مكتملة": True, "مسودة": False}
+
+async def show_response_filters(key_prefix, governorate_id=None):
+    """عرض عناصر تصفية الإجابات وإرجاع قاموس التصفية"""
+    filters = {'governorate_id': governorate_id}
+
+    with st.expander("🔎 تصفية الإجابات", expanded=False):
+        col1, col2 = st.columns(2)
+        with col1:
+            if governorate_id is None:
+                governorates = await db.get_governorates_list()
+                filters['governorate_id'] = st.selectbox(
+                    "المحافظة",
+                    options=[None] + [g[0] for g in governorates],
+                    format_func=lambda x: "الكل" if x is None else next(g[1] for g in governorates if g[0] == x),
+                    key=f"{key_prefix}_filter_gov"
+                )
+
+            if filters['governorate_id'] is not None:
+                health_admins = await db.get_health_admins_by_governorate(filters['governorate_id'])
+            else:
+                health_admins = await db.get_health_admins()
+            filters['admin_id'] = st.selectbox(
+                "الإدارة الصحية",
+                options=[None] + [a[0] for a in health_admins],
+                format_func=lambda x: "الكل" if x is None else next(a[1] for a in health_admins if a[0] == x),
+                key=f"{key_prefix}_filter_admin"
+            )
+            filters['username'] = st.text_input("اسم المستخدم (يبدأ بـ)", key=f"{key_prefix}_filter_user").strip()
+        with col2:
+            date_range = st.date_input("نطاق التاريخ", value=(), key=f"{key_prefix}_filter_dates")
+            if len(date_range) == 2:
+                filters['date_from'], filters['date_to'] = date_range
+            elif len(date_range) == 1:
+                filters['date_from'] = date_range[0]
+            status = st.radio("الحالة", list(STATUS_OPTIONS.keys()), horizontal=True,
+                              key=f"{key_prefix}_filter_status")
+            filters['is_completed'] = STATUS_OPTIONS[status]
+
+    return filters
+
+def _filters_key(filters):
+    return tuple(sorted((k, str(v)) for k, v in filters.items() if v not in (None, '')))
+
+async def load_response_stats(survey_id, filters, version=None):
+    """عدد الإجابات المطابقة للتصفية وعدد المكتملة وعدد المناطق"""
+    return await load_for_version(
+        survey_id, ('stats', _filters_key(filters)),
+        lambda: db.count_survey_responses(survey_id, filters),
+        version
+    )
+
+async def show_response_page(survey_id, filters, total, key_prefix, show_governorate=True, version=None):
+    """عرض صفحة واحدة من الإجابات مع أزرار التنقل وإرجاع الإجابة المختارة"""
+    filters_key = _filters_key(filters)
+    state_key = f"{key_prefix}_pager"
+    pager = st.session_state.get(state_key)
+    if not pager or pager['filters'] != filters_key:
+        pager = {'filters': filters_key, 'cursors': [None]}
+        st.session_state[state_key] = pager
+
+    page_size = st.selectbox("عدد الإجابات في الصفحة", PAGE_SIZES, index=1, key=f"{key_prefix}_page_size")
+    if pager.get('page_size') != page_size:
+        pager['page_size'] = page_size
+        pager['cursors'] = [None]
+
+    cursor = pager['cursors'][-1]
+    rows = await load_for_version(
+        survey_id, ('page', filters_key, cursor, page_size),
+        lambda: db.get_survey_responses_page(survey_id, filters, page_size, cursor),
+        version
+    )
+
+    columns = ["ID", "المستخدم", "الإدارة الصحية", "المحافظة", "تاريخ التقديم", "الحالة"]
+    df = pd.DataFrame(
+        [(r[0], r[1], r[2], r[3], r[4], "مكتملة" if r[5] else "مسودة") for r in rows],
+        columns=columns
+    )
+    if not show_governorate:
+        df = df.drop(columns=["المحافظة"])
+    st.dataframe(df, use_container_width=True, hide_index=True)
+
+    page_number = len(pager['cursors'])
+    page_count = max((total + page_size - 1) // page_size, 1)
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ السابق", key=f"{key_prefix}_prev", disabled=page_number == 1):
+            pager['cursors'].pop()
+            st.rerun()
+    with col2:
+        st.caption(f"صفحة {page_number} من {page_count} — {total} إجابة")
+    with col3:
+        if st.button("التالي ➡️", key=f"{key_prefix}_next", disabled=len(rows) < page_size or page_number >= page_count):
+            last = rows[-1]
+            pager['cursors'].append((last[4], last[0]))
+            st.rerun()
+
+    if not rows:
+        return None
+
+    return st.selectbox(
+        "اختر إجابة لعرض وتعديل تفاصيلها",
+        options=[r[0] for r in rows],
+        format_func=lambda x: f"إجابة #{x}",
+        key=f"{key_prefix}_select_response"
+    )
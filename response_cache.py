@@ -0,0 +1,28 @@
+import streamlit as st
+from database import db
+
+MAX_CACHED_ENTRIES = 50
+
+async def load_for_version(survey_id, key, loader, version=None):
+    """إرجاع نتيجة مخزنة في الجلسة ما دام إصدار بيانات الاستبيان لم يتغير"""
+    if version is None:
+        version = await db.get_survey_data_version(survey_id)
+
+    cache = st.session_state.setdefault(f"survey_data_cache_{survey_id}", {})
+
+    # حذف جميع النتائج المخزنة عند تغير بيانات الاستبيان
+    if cache.get('version') != version:
+        cache.clear()
+        cache['version'] = version
+        cache['entries'] = {}
+
+    entries = cache['entries']
+    if key in entries:
+        return entries[key]
+
+    value = await loader()
+    if version is not None:
+        if len(entries) >= MAX_CACHED_ENTRIES:
+            del entries[next(iter(entries))]
+        entries[key] = value
+    return value
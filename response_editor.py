@@ -0,0 +1,97 @@
+import streamlit as st
+import json
+from database import db
+from fragments import async_fragment, rerun_fragment
+
+@async_fragment
+async def show_response_editor(response_id, key_prefix):
+    """عرض وتعديل تفاصيل إجابة كجزء مستقل يعاد تشغيله وحده عند الحفظ أو الإلغاء"""
+    response_info = await db.get_response_info(response_id)
+    if not response_info:
+        return
+
+    st.subheader(f"تفاصيل الإجابة #{response_id}")
+    st.markdown(f"""
+    **الاستبيان:** {response_info[1]}  
+    **المستخدم:** {response_info[2]}  
+    **الإدارة الصحية:** {response_info[3]}  
+    **المحافظة:** {response_info[4]}  
+    **تاريخ التقديم:** {response_info[5]}
+    """)
+
+    message_key = f"{key_prefix}_editor_message_{response_id}"
+    if message_key in st.session_state:
+        level, text = st.session_state.pop(message_key)
+        getattr(st, level)(text)
+
+    # الإصدار الذي بدأ عنده التعديل، للتحقق من عدم تعديل الإجابة من مستخدم آخر قبل الحفظ
+    version_key = f"{key_prefix}_editor_version_{response_id}"
+    if version_key not in st.session_state:
+        st.session_state[version_key] = response_info[6]
+
+    details = await db.get_response_details(response_id)
+    updates = {}
+
+    with st.form(key=f"{key_prefix}_edit_response_{response_id}"):
+        for detail in details:
+            detail_id, field_id, label, field_type, options, answer = detail
+
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                st.markdown(f"**{label}**")
+            with col2:
+                if field_type == 'dropdown':
+                    options_list = json.loads(options) if options else []
+                    new_value = st.selectbox(
+                        f"تعديل {label}",
+                        options_list,
+                        index=options_list.index(answer) if answer in options_list else 0,
+                        key=f"{key_prefix}_dropdown_{detail_id}_{response_id}"
+                    )
+                else:
+                    new_value = st.text_input(
+                        f"تعديل {label}",
+                        value=answer,
+                        key=f"{key_prefix}_input_{detail_id}_{response_id}"
+                    )
+
+                if new_value != answer:
+                    updates[detail_id] = new_value
+
+        col1, col2 = st.columns(2)
+        with col1:
+            save_clicked = st.form_submit_button("💾 حفظ جميع التعديلات")
+        with col2:
+            cancel_clicked = st.form_submit_button("❌ إلغاء التعديلات")
+
+    if save_clicked:
+        if updates:
+            new_version = await db.update_response_details(
+                response_id, updates, st.session_state[version_key]
+            )
+
+            if new_version:
+                st.session_state[version_key] = new_version
+                st.session_state[message_key] = ('success', f"تم تحديث {len(updates)} تعديلات بنجاح")
+            elif new_version == 0:
+                _reset_editor(key_prefix, response_id)
+                st.session_state[message_key] = (
+                    'warning', "تم تعديل هذه الإجابة من مستخدم آخر، تم تحميل أحدث البيانات. يرجى إعادة التعديل"
+                )
+            else:
+                st.session_state[message_key] = ('error', "لم يتم حفظ التعديلات")
+            rerun_fragment()
+        else:
+            st.info("لم تقم بإجراء أي تعديلات")
+
+    if cancel_clicked:
+        _reset_editor(key_prefix, response_id)
+        rerun_fragment()
+
+def _reset_editor(key_prefix, response_id):
+    """مسح قيم الحقول والإصدار المحفوظ لإعادة تحميل الإجابة من قاعدة البيانات"""
+    widget_prefixes = (f"{key_prefix}_dropdown_", f"{key_prefix}_input_")
+    for key in [k for k in st.session_state.keys()
+                if str(k).startswith(widget_prefixes) and str(k).endswith(f"_{response_id}")]:
+        del st.session_state[key]
+    st.session_state.pop(f"{key_prefix}_editor_version_{response_id}", None)
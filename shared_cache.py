@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# الكتابة داخل هذه الكتلة لا تلغي البيانات المخزنة (مثل أوقات النشاط التي لا يعتمد عليها أي تخزين)
+_untracked: contextvars.ContextVar[bool] = contextvars.ContextVar('shared_cache_untracked', default=False)
+
+class SharedCache:
+    """ذاكرة مؤقتة مشتركة بين جميع عمليات Streamlit على نفس الجهاز في ملف SQLite.
+    كل قيمة تُحفظ مع أرقام إصدار الجداول التي تعتمد عليها، وأي كتابة في جدول من أي عملية
+    ترفع رقم إصداره فتصبح القيم المعتمدة عليه قديمة في جميع العمليات"""
+
+    def __init__(self, path: Optional[str], ttl: float = 3600.0):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._initialized = False
+        # يُعطل في هذه العملية إذا تعذر تسجيل كتابة، لأن قيمه لم تعد مضمونة الحداثة
+        self._disabled = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and not self._disabled
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            with self._lock:
+                if self._initialized:
+                    return conn
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS table_versions (
+                        table_name TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS cache_entries (
+                        cache_key TEXT PRIMARY KEY,
+                        stamp TEXT NOT NULL,
+                        value BLOB NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                """)
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    @staticmethod
+    def _stamp(conn: sqlite3.Connection, tables: Tuple[str, ...]) -> str:
+        versions = dict(conn.execute(
+            f"SELECT table_name, version FROM table_versions WHERE table_name IN ({', '.join('?' * len(tables))})",
+            tables).fetchall())
+        return "|".join(f"{table}:{versions.get(table, 0)}" for table in sorted(tables))
+
+    def _get_many(self, keys: list, tables: Tuple[str, ...]) -> Tuple[Dict[str, Any], str]:
+        with closing(self._connect()) as conn:
+            # يُقرأ الإصدار قبل الجلب من قاعدة البيانات حتى لا تُحفظ قيمة أقدم من كتابة حدثت أثناء الجلب
+            stamp = self._stamp(conn, tables)
+            rows = conn.execute(
+                f"""SELECT cache_key, value FROM cache_entries
+                    WHERE cache_key IN ({', '.join('?' * len(keys))}) AND stamp = ? AND expires_at > ?""",
+                keys + [stamp, time.time()]).fetchall()
+        return {key: pickle.loads(value) for key, value in rows}, stamp
+
+    def _put_many(self, items: Dict[str, Any], stamp: str, ttl: float):
+        expires_at = time.time() + ttl
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                """INSERT INTO cache_entries (cache_key, stamp, value, expires_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(cache_key) DO UPDATE SET
+                       stamp = excluded.stamp, value = excluded.value, expires_at = excluded.expires_at""",
+                [(key, stamp, pickle.dumps(value), expires_at) for key, value in items.items()])
+            conn.commit()
+
+    async def get_or_load(self, key: str, tables: Iterable[str], loader: Callable[[], Awaitable[Any]],
+                          ttl: Optional[float] = None) -> Any:
+        """إرجاع القيمة المخزنة ما دامت جداولها لم تتغير، وإلا جلبها وتخزينها لجميع العمليات"""
+        values = await self.get_or_load_many(
+            key, [None], tables, lambda _: _load_one(loader), ttl)
+        return values.get(None)
+
+    async def get_or_load_many(self, name: str, keys: Iterable[Any], tables: Iterable[str],
+                               loader: Callable[[list], Awaitable[Dict[Any, Any]]],
+                               ttl: Optional[float] = None) -> Dict[Any, Any]:
+        """نسخة مجمعة: تُجلب فقط المفاتيح غير المخزنة باستدعاء واحد لـ loader الذي يرجع قاموساً"""
+        keys = list(keys)
+        if not self.enabled or not keys:
+            return await loader(keys) if keys else {}
+
+        tables = tuple(tables)
+        cache_keys = {key: name if key is None else f"{name}:{key}" for key in keys}
+        # عمليات ملف SQLite تعمل في خيط منفصل حتى لا تحجز الحلقة المشتركة
+        try:
+            cached, stamp = await asyncio.to_thread(self._get_many, list(cache_keys.values()), tables)
+        except (sqlite3.Error, pickle.UnpicklingError):
+            return await loader(keys)
+
+        values = {key: cached[cache_key] for key, cache_key in cache_keys.items() if cache_key in cached}
+        missing = [key for key in keys if key not in values]
+        if missing:
+            loaded = await loader(missing)
+            values.update(loaded)
+            try:
+                await asyncio.to_thread(
+                    self._put_many, {cache_keys[key]: value for key, value in loaded.items() if key in cache_keys},
+                    stamp, ttl if ttl is not None else self.ttl)
+            except (sqlite3.Error, pickle.PicklingError):
+                pass
+        return values
+
+    def _bump_versions(self, tables: set):
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                """INSERT INTO table_versions (table_name, version) VALUES (?, 1)
+                   ON CONFLICT(table_name) DO UPDATE SET version = version + 1""",
+                [(table,) for table in tables])
+            # حذف القيم المنتهية حتى لا يكبر الملف
+            conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+
+    def _drop_dependent(self, tables: set):
+        with closing(self._connect()) as conn:
+            # الختم بصيغة "جدول:إصدار|جدول:إصدار"
+            conn.executemany(
+                "DELETE FROM cache_entries WHERE stamp LIKE ? OR stamp LIKE ?",
+                [(f"{table}:%", f"%|{table}:%") for table in tables])
+            conn.commit()
+
+    async def invalidate(self, tables: Iterable[str]):
+        """رفع أرقام إصدار الجداول بعد الكتابة فيها لتصبح القيم المعتمدة عليها قديمة في جميع العمليات"""
+        tables = set(tables)
+        if not self.enabled or not tables or _untracked.get():
+            return
+        try:
+            await asyncio.to_thread(self._bump_versions, tables)
+        except sqlite3.Error:
+            # الفشل مغلق: لا تُقرأ الذاكرة المشتركة في هذه العملية بعد الآن،
+            # وتُحذف القيم المعتمدة على الجداول المعدلة حتى لا تقرأها العمليات الأخرى
+            logger.exception("تعذر تحديث إصدارات الذاكرة المشتركة للجداول %s، تم تعطيلها في هذه العملية",
+                             sorted(tables))
+            self._disabled = True
+            try:
+                await asyncio.to_thread(self._drop_dependent, tables)
+            except sqlite3.Error:
+                logger.exception("تعذر حذف القيم المعتمدة على الجداول %s من الذاكرة المشتركة", sorted(tables))
+
+    @contextmanager
+    def untracked(self):
+        """كتابة لا تلغي البيانات المخزنة، لأعمدة لا تعتمد عليها أي قيمة مخزنة"""
+        token = _untracked.set(True)
+        try:
+            yield
+        finally:
+            _untracked.reset(token)
+
+async def _load_one(loader):
+    return {None: await loader()}
+
+# معطلة ما لم يُحدد مسار الملف، ويُستخدم نفس المسار في جميع عمليات الجهاز
+shared_cache = SharedCache(
+    os.getenv('SHARED_CACHE_PATH'),
+    float(os.getenv('SHARED_CACHE_TTL', '3600'))
+)
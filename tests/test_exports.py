@@ -0,0 +1,65 @@
+import asyncio
+import os
+
+import pytest
+
+import exports
+from database import db
+from export_cache import ExportCache
+
+FIELDS = [(1, 7, "الاسم", "text", None, 1, 1, 1)]
+RESPONSES = [(10, "employee", "إدارة", "محافظة", "2024-01-01 10:00:00", 1)]
+DETAILS = [(100, 10, "الاسم", "أحمد", "employee", "2024-01-01 10:00:00", 1, 7)]
+
+class FakeD1:
+    """بديل لـ D1 يرجع بيانات ثابتة ويفشل في الاستعلام الذي يحتوي على النص المحدد"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+
+    async def fetch_all(self, sql, params=()):
+        if self.fail_on and self.fail_on in sql:
+            raise RuntimeError("D1 unavailable")
+        if "FROM Survey_Fields" in sql:
+            return FIELDS
+        if "FROM Response_Details" in sql:
+            return DETAILS if params[1] == 0 else []
+        if "FROM Responses" in sql:
+            return RESPONSES
+        return []
+
+class FakeContext:
+    def report(self, progress=None, message=None):
+        pass
+
+    def check_cancelled(self):
+        pass
+
+    async def run_in_pool(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ExportCache(str(tmp_path), 1024 * 1024)
+    monkeypatch.setattr(exports, "export_cache", cache)
+    return cache
+
+def run_job(monkeypatch, d1, export_format):
+    monkeypatch.setattr(db, "d1", d1)
+    return asyncio.run(exports.run_export_job(
+        FakeContext(), export_format, 1, "export", cache_key="key"))
+
+@pytest.mark.parametrize("export_format", [exports.EXPORT_FULL, exports.EXPORT_WIDE_CSV])
+def test_successful_export_is_cached(cache, monkeypatch, export_format):
+    result = run_job(monkeypatch, FakeD1(), export_format)
+
+    assert cache.get("key") == result['data']
+
+@pytest.mark.parametrize("fail_on", ["FROM Responses", "FROM Survey_Fields", "FROM Response_Details"])
+@pytest.mark.parametrize("export_format", [exports.EXPORT_FULL, exports.EXPORT_WIDE_CSV])
+def test_d1_failure_fails_job_and_leaves_cache_empty(cache, monkeypatch, export_format, fail_on):
+    with pytest.raises(RuntimeError):
+        run_job(monkeypatch, FakeD1(fail_on), export_format)
+
+    assert cache.get("key") is None
+    assert os.listdir(cache.directory) == []
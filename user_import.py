@@ -0,0 +1,112 @@
+import pandas as pd
+from database import db
+
+IMPORT_COLUMNS = ["username", "password", "role", "governorate", "health_administration", "surveys"]
+IMPORT_ROLES = ["admin", "governorate_admin", "employee"]
+SURVEYS_SEPARATOR = ";"
+
+def read_users_file(uploaded_file):
+    """قراءة ملف CSV أو Excel يحتوي على بيانات المستخدمين"""
+    if uploaded_file.name.lower().endswith(".csv"):
+        df = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False)
+    else:
+        df = pd.read_excel(uploaded_file, dtype=str).fillna("")
+
+    df.columns = [str(column).strip().lower() for column in df.columns]
+    for column in IMPORT_COLUMNS:
+        if column not in df.columns:
+            df[column] = ""
+
+    df = df[IMPORT_COLUMNS].astype(str).apply(lambda column: column.str.strip())
+    df["role"] = df["role"].replace("", "employee")
+    return df.reset_index(drop=True)
+
+async def validate_users_frame(df):
+    """التحقق من جميع صفوف الملف دفعة واحدة وإرجاعها مع عمود الأخطاء"""
+    df = df.copy()
+    errors = pd.Series("", index=df.index)
+
+    def flag(mask, message):
+        errors[mask] = errors[mask] + message + "؛ "
+
+    flag(df["username"] == "", "اسم المستخدم مطلوب")
+    flag(df["password"] == "", "كلمة المرور مطلوبة")
+    flag(~df["role"].isin(IMPORT_ROLES), "دور غير معروف")
+    flag((df["username"] != "") & df["username"].duplicated(keep=False), "اسم المستخدم مكرر في الملف")
+
+    existing = await db.get_existing_usernames(df.loc[df["username"] != "", "username"])
+    flag(df["username"].isin(existing), "اسم المستخدم موجود بالفعل")
+
+    # المحافظات والإدارات الصحية بالاسم
+    governorates = await db.get_governorates_list()
+    df["governorate_id"] = df["governorate"].map({g[1]: g[0] for g in governorates})
+
+    admins = pd.DataFrame(
+        await db.get_health_admins_with_governorates(),
+        columns=["admin_id", "health_administration", "admin_governorate_id", "governorate"]
+    )
+    df = df.merge(admins[["admin_id", "health_administration", "governorate"]],
+                  on=["governorate", "health_administration"], how="left")
+
+    needs_governorate = df["role"].isin(["governorate_admin", "employee"])
+    flag(needs_governorate & df["governorate_id"].isna(), "محافظة غير معروفة")
+    flag((df["role"] == "employee") & df["governorate_id"].notna() & df["admin_id"].isna(),
+         "إدارة صحية غير معروفة في هذه المحافظة")
+
+    # الاستبيانات المطلوبة لكل صف مفصولة بفاصلة منقوطة
+    surveys = await db.d1.fetch_all("SELECT survey_id, survey_name FROM Surveys")
+    requested = df["surveys"].str.split(SURVEYS_SEPARATOR).explode().str.strip()
+    requested = requested[(requested != "") & (df.loc[requested.index, "role"] != "admin")]
+    survey_ids = requested.map({s[1]: s[0] for s in surveys})
+    flag(df.index.isin(survey_ids[survey_ids.isna()].index.unique()), "استبيان غير معروف")
+
+    allowed = pd.MultiIndex.from_tuples(await db.get_survey_governorates() or [], names=["survey_id", "governorate_id"])
+    known = survey_ids.dropna().astype(int)
+    pairs = pd.MultiIndex.from_arrays(
+        [known.values, df.loc[known.index, "governorate_id"].values],
+        names=["survey_id", "governorate_id"]
+    )
+    not_allowed = known.index[~pairs.isin(allowed)]
+    flag(df.index.isin(not_allowed.unique()), "استبيان غير مسموح لمحافظة المستخدم")
+
+    df["survey_ids"] = known.groupby(level=0).agg(lambda ids: sorted(set(ids))).reindex(df.index)
+    df["survey_ids"] = df["survey_ids"].apply(lambda ids: ids if isinstance(ids, list) else [])
+    df["errors"] = errors.str.rstrip("؛ ")
+    return df
+
+async def import_users(valid_df, progress=None):
+    """إضافة المستخدمين الصالحين مع صلاحياتهم على دفعات"""
+    users = [
+        (row.username, row.password, row.role,
+         int(row.admin_id) if row.role == "employee" and pd.notna(row.admin_id) else None)
+        for row in valid_df.itertuples(index=False)
+    ]
+    user_ids = await db.bulk_add_users(users)
+    if progress:
+        progress(0.6)
+
+    governorate_admins = valid_df[valid_df["role"] == "governorate_admin"]
+    await db.bulk_add_governorate_admins([
+        (user_ids[row.username], int(row.governorate_id))
+        for row in governorate_admins.itertuples(index=False) if row.username in user_ids
+    ])
+    if progress:
+        progress(0.8)
+
+    permissions = valid_df[["username", "survey_ids"]].explode("survey_ids").dropna()
+    await db.bulk_add_user_surveys([
+        (user_ids[username], int(survey_id))
+        for username, survey_id in permissions.itertuples(index=False, name=None) if username in user_ids
+    ])
+
+    return len(user_ids)
+
+async def run_import_job(ctx, valid_df):
+    """مهمة خلفية لاستيراد المستخدمين مع الإبلاغ عن التقدم"""
+    ctx.report(0.1, "جاري إضافة المستخدمين")
+    count = await import_users(valid_df, lambda value: ctx.report(value))
+    return {'imported': count}
+
+def users_template_csv():
+    """ملف CSV فارغ بالأعمدة المطلوبة للاستيراد"""
+    return ("﻿" + ",".join(IMPORT_COLUMNS) + "\n").encode("utf-8")
@@ -0,0 +1,136 @@
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from event_loop import background_loop
+from cloudflare import d1_priority, PRIORITY_BULK
+from shared_cache import shared_cache
+
+# الأعمدة المسموح بتحديثها بشكل مؤجل في جدول المستخدمين
+USER_TIMESTAMP_COLUMNS = ("last_login", "last_activity")
+
+class WriteBehindQueue:
+    """تأجيل عمليات الكتابة غير الحرجة ودمجها ثم كتابتها على دفعات في الخلفية"""
+
+    def __init__(self, flush_interval: float = 2.0, max_pending: int = 100):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task = None
+        self._user_timestamps: Dict[str, Dict[int, str]] = {column: {} for column in USER_TIMESTAMP_COLUMNS}
+        self._audit_rows: List[tuple] = []
+
+    @staticmethod
+    def _now() -> str:
+        # نفس صيغة CURRENT_TIMESTAMP حتى يُحفظ وقت الحدث لا وقت الكتابة
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+    def _pending(self) -> int:
+        return sum(len(users) for users in self._user_timestamps.values()) + len(self._audit_rows)
+
+    def touch_user(self, column: str, user_id: int):
+        """تسجيل تحديث وقت للمستخدم؛ التحديثات المتكررة لنفس المستخدم تُدمج في واحد"""
+        if column not in USER_TIMESTAMP_COLUMNS:
+            raise ValueError(f"عمود غير مسموح: {column}")
+        with self._lock:
+            self._user_timestamps[column][user_id] = self._now()
+            pending = self._pending()
+        self._schedule(pending)
+
+    def add_audit(self, user_id, action_type, table_name, record_id=None, old_value=None, new_value=None):
+        """إضافة سجل تعديل إلى قائمة الانتظار"""
+        row = (user_id, action_type, table_name, record_id,
+               json.dumps(old_value) if old_value else None,
+               json.dumps(new_value) if new_value else None,
+               self._now())
+        with self._lock:
+            self._audit_rows.append(row)
+            pending = self._pending()
+        self._schedule(pending)
+
+    def _schedule(self, pending: int):
+        self.start()
+        if pending >= self.max_pending and self._wake is not None:
+            background_loop.loop.call_soon_threadsafe(self._wake.set)
+
+    def _take(self):
+        with self._lock:
+            user_timestamps = self._user_timestamps
+            audit_rows = self._audit_rows
+            self._user_timestamps = {column: {} for column in USER_TIMESTAMP_COLUMNS}
+            self._audit_rows = []
+        return user_timestamps, audit_rows
+
+    def _restore(self, user_timestamps, audit_rows):
+        # إعادة ما فشلت كتابته مع الاحتفاظ بالأحدث لكل مستخدم
+        with self._lock:
+            for column, users in user_timestamps.items():
+                for user_id, timestamp in users.items():
+                    current = self._user_timestamps[column].get(user_id)
+                    if current is None or current < timestamp:
+                        self._user_timestamps[column][user_id] = timestamp
+            self._audit_rows[:0] = audit_rows
+
+    async def flush(self) -> int:
+        """كتابة جميع العمليات المنتظرة وإرجاع عددها"""
+        if not background_loop.in_loop():
+            return await background_loop.call(self.flush())
+
+        from database import db
+
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            user_timestamps, audit_rows = self._take()
+            try:
+                # أوقات النشاط والتعديلات لا تعتمد عليها أي بيانات في الذاكرة المشتركة
+                with d1_priority(PRIORITY_BULK), shared_cache.untracked():
+                    await db.apply_write_behind(user_timestamps, audit_rows)
+            except Exception:
+                self._restore(user_timestamps, audit_rows)
+                raise
+        return sum(len(users) for users in user_timestamps.values()) + len(audit_rows)
+
+    async def _flush_forever(self):
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            with self._lock:
+                if not self._pending():
+                    continue
+            try:
+                await self.flush()
+            except Exception:
+                # تبقى العمليات في قائمة الانتظار لمحاولة لاحقة
+                pass
+
+    def start(self):
+        """تشغيل الكتابة في الخلفية على الحلقة المشتركة مرة واحدة لكل عملية"""
+        with self._lock:
+            if self._task is None:
+                self._task = background_loop.submit(self._flush_forever())
+
+    def shutdown(self):
+        """كتابة كل ما تبقى قبل إيقاف العملية"""
+        with self._lock:
+            if not self._pending():
+                return
+        try:
+            background_loop.run(self.flush(), timeout=30)
+        except Exception:
+            pass
+
+write_behind = WriteBehindQueue(
+    float(os.getenv('WRITE_BEHIND_INTERVAL', '2')),
+    int(os.getenv('WRITE_BEHIND_MAX_PENDING', '100'))
+)
+atexit.register(write_behind.shutdown)